@@ -0,0 +1,88 @@
+''' Micro-benchmark for ducker.dilute_desc over a synthetic docstring corpus.
+
+    python benches/bench_ducker.py [--count 100000]
+
+Times the single-pass renderer, the memoized renderer (the corpus repeats
+common docstrings the way real libraries do) and the old chain of
+str.replace/re.sub calls it replaced, so the speedup can be tracked. '''
+
+import os, random, re, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ducker
+
+WORDS = 'the a value returns list of items when given path file name is not none self index count'.split()
+
+
+def corpus(count=100_000, seed=0):
+	rnd = random.Random(seed)
+	common = ['Returns None.', 'Initialize self.', 'See **base class** for details.']
+	docs = []
+	for i in range(count):
+		if rnd.random() < 0.2:
+			docs.append(rnd.choice(common))
+			continue
+		lines = []
+		for _ in range(rnd.randint(1, 8)):
+			words = [rnd.choice(WORDS) for _ in range(rnd.randint(3, 12))]
+			roll = rnd.random()
+			if roll < 0.1: words.append(f'[docs](http://example.com/{i})')
+			elif roll < 0.2: words.append(f'**{rnd.choice(WORDS)}**')
+			elif roll < 0.25: words.append(f'`{rnd.choice(["code", "error", "example"])} {rnd.choice(WORDS)}()`')
+			lines.append(('\t' if roll > 0.9 else '') + ' '.join(words))
+		docs.append('\n'.join(lines))
+	return docs
+
+
+def legacy(doc):
+	''' dilute_desc as it was before the single-pass renderer '''
+	doc = doc.replace('\n', '<br>').replace('\t', '&nbsp;&nbsp;&nbsp;&nbsp;').replace(' ', '&nbsp;')
+	doc = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2"> \1 </a>', doc)
+	blocks = r'''
+		<div class="[X]block">
+			<p id="[X]block-h"> [X] </p>
+			<code id="[X]block-main" style="font-size: 14px;"> \1 </code>
+		</div>
+	'''
+	doc = re.sub(r'`code(.*)`', str(blocks.replace('[X]', 'code')), doc)
+	doc = re.sub(r'`error(.*)`', str(blocks.replace('[X]', 'error')), doc)
+	doc = re.sub(r'`example(.*)`', str(blocks.replace('[X]', 'example')), doc)
+	doc = re.sub(r'\*\*(.*)\*\*', r'<b> \1 </b>', doc)
+	return doc
+
+
+CORPUS = []
+
+
+def _corpus():
+	if not CORPUS: CORPUS.extend(corpus())
+	return CORPUS
+
+
+def bench_dilute_desc():
+	for doc in _corpus(): ducker.dilute_desc.__wrapped__(doc)
+
+
+def bench_dilute_desc_memo():
+	ducker.dilute_desc.cache_clear()
+	for doc in _corpus(): ducker.dilute_desc(doc)
+
+
+def bench_dilute_desc_legacy():
+	for doc in _corpus(): legacy(doc)
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description="Time dilute_desc over a synthetic corpus")
+	parser.add_argument("--count", help="number of docstrings", type=int, default=100_000)
+	args = parser.parse_args()
+
+	CORPUS.extend(corpus(args.count))
+	results = {}
+	for name, fn in [('single-pass', bench_dilute_desc), ('memoized', bench_dilute_desc_memo), ('legacy', bench_dilute_desc_legacy)]:
+		start = time.perf_counter()
+		fn()
+		results[name] = time.perf_counter() - start
+		print(f'{name:>12}: {results[name]:.3f}s  ({results[name] / len(CORPUS) * 1e6:.2f} us/docstring)')
+	print(f'     speedup: {results["legacy"] / results["single-pass"]:.2f}x single-pass, {results["legacy"] / results["memoized"]:.2f}x memoized')
@@ -0,0 +1,75 @@
+''' Startup-time regression benchmark for the duck CLI.
+
+    python benches/bench_startup.py [--runs 20] [--budget 50] [--help-budget 100]
+
+Times `duck --help` and `duck run` on an empty script against a bare
+interpreter starting the same script, and fails when duck's own overhead
+goes past the budget (milliseconds). `duck run` skips click and must stay
+within --budget. `duck --help` can not: importing click alone costs 50-70ms,
+so it has a budget of its own. `duck bench` picks up the bench_*
+functions too, so `duck bench --compare` catches startup regressions. '''
+
+import os, statistics, subprocess, sys, tempfile, time
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main.py')
+PROJECT = []
+
+
+def _project():
+	''' A throwaway duck project whose main file does nothing '''
+	if not PROJECT:
+		path = tempfile.mkdtemp(prefix='duck-startup-')
+		os.makedirs(os.path.join(path, 'src'))
+		with open(os.path.join(path, 'src', 'main.py'), 'w') as f: f.write('')
+		with open(os.path.join(path, 'duck.toml'), 'w') as f: f.write('[main]\nfile = "src/main.py"\n')
+		PROJECT.append(path)
+	return PROJECT[0]
+
+
+# duck is timed as installed: with its bytecode cached, even where the
+# environment turns that off for development
+ENV = {k: v for k, v in os.environ.items() if k != 'PYTHONDONTWRITEBYTECODE'}
+
+
+def _spawn(*args):
+	subprocess.run([sys.executable, *args], cwd=_project(), env=ENV, stdout=subprocess.DEVNULL, check=True)
+
+
+def bench_python():
+	_spawn('src/main.py')
+
+
+def bench_help():
+	_spawn(MAIN, '--help')
+
+
+def bench_run_dispatch():
+	_spawn(MAIN, 'run')
+
+
+def median_ms(fn, runs):
+	times = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		fn()
+		times.append(time.perf_counter() - start)
+	return statistics.median(times) * 1000
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description="Time duck's startup")
+	parser.add_argument("--runs", help="runs per command", type=int, default=20)
+	parser.add_argument("--budget", help="allowed overhead of duck run over a bare interpreter, ms", type=float, default=50)
+	parser.add_argument("--help-budget", help="allowed overhead of duck --help, ms", type=float, default=100)
+	args = parser.parse_args()
+
+	_spawn(MAIN, '--help')
+	base = median_ms(bench_python, args.runs)
+	print(f'      python: {base:7.1f}ms')
+	over = False
+	for name, fn, budget in [('duck --help', bench_help, args.help_budget), ('duck run', bench_run_dispatch, args.budget)]:
+		took = median_ms(fn, args.runs)
+		over |= took - base > budget
+		print(f'{name:>12}: {took:7.1f}ms  (+{took - base:.1f}ms over python, budget {budget:.0f}ms)')
+	sys.exit(1 if over else 0)
@@ -0,0 +1,161 @@
+''' Benchmarks for `duck bench`.
+
+Run as a script, it imports every module in the benches directory, finds
+the `bench_*` functions (called without arguments) and times them:
+
+    python duckbench.py <benches dir> <results.json> [filter]
+
+Each benchmark is warmed up, then its iteration count is calibrated so one
+timed batch lasts at least `MIN_TIME`, and `SAMPLES` batches are recorded.
+The duck side keeps every run in debug/bench/history.jsonl and compares runs. '''
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HISTORY = 'debug/bench/history.jsonl'
+MIN_TIME = 0.01
+WARMUP = 0.1
+SAMPLES = 25
+
+
+def discover(directory):
+    ''' [(name, function)] for every bench_* function in every module of `directory` '''
+    import importlib.util
+
+    found = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.py') or name.startswith('_'):
+            continue
+        path = os.path.join(directory, name)
+        spec = importlib.util.spec_from_file_location(f'_duck_bench_{name[:-3]}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        for attr in sorted(vars(module)):
+            fn = getattr(module, attr)
+            if attr.startswith('bench_') and callable(fn) and getattr(fn, '__module__', None) == module.__name__:
+                found.append((f'{name[:-3]}.{attr}', fn))
+    return found
+
+
+def batch(fn, number):
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(number):
+        fn()
+    return clock() - start
+
+
+def measure(fn, samples=SAMPLES, min_time=MIN_TIME, warmup=WARMUP):
+    ''' Per-call seconds for `samples` calibrated batches, after warming up '''
+    number, elapsed = 1, batch(fn, 1)
+    while elapsed < min_time:
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+        elapsed = batch(fn, number)
+    deadline = time.perf_counter() + warmup
+    while time.perf_counter() < deadline:
+        batch(fn, number)
+    return number, [batch(fn, number) / number for _ in range(samples)]
+
+
+def summarize(number, times):
+    cuts = statistics.quantiles(times, n=100, method='inclusive') if len(times) > 1 else times * 99
+    return {
+        'iterations': number,
+        'samples': len(times),
+        'median': statistics.median(times),
+        'p10': cuts[9],
+        'p90': cuts[89],
+        'min': min(times),
+    }
+
+
+def run(directory, pattern=''):
+    results = {}
+    for name, fn in discover(directory):
+        if pattern in name:
+            results[name] = summarize(*measure(fn))
+    return results
+
+
+# ------------------------------
+# duck side
+
+def revision(cwd, ref='HEAD', short=True):
+    ''' The commit `ref` names in the git repository at `cwd`, None outside one
+    or when it names none '''
+    try:
+        return subprocess.run(['git', 'rev-parse', *(['--short'] if short else []), '--verify', '--quiet',
+                               f'{ref}^{{commit}}'], cwd=cwd, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def history(path=HISTORY):
+    runs = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    runs.append(json.loads(line))
+    except (OSError, ValueError):
+        pass
+    return runs
+
+
+def record(run, path=HISTORY):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(run, sort_keys=True) + '\n')
+
+
+def find(runs, ref, cwd='.'):
+    ''' The newest stored run matching `ref`: `last` for the newest one, a
+    --save name, a run id, or anything git resolves to a commit (a revision,
+    branch, tag, HEAD~1) that a run was recorded at '''
+    if ref == 'last':
+        return runs[-1] if runs else None
+    for run in reversed(runs):
+        if ref in (run.get('name'), run.get('id')):
+            return run
+    commit = revision(cwd, ref, short=False)
+    if commit is None:
+        return None
+    for run in reversed(runs):
+        # runs store the short form, which is a prefix of the full hash
+        if run.get('rev') and commit.startswith(run['rev']):
+            return run
+    return None
+
+
+def compare(current, reference, threshold):
+    ''' [(name, reference median, current median, ratio, regressed)] for
+    benchmarks present in both runs '''
+    rows = []
+    for name, result in current.items():
+        ref = reference.get(name)
+        if not ref:
+            continue
+        ratio = result['median'] / ref['median'] if ref['median'] else float('inf')
+        rows.append((name, ref['median'], result['median'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def units(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds >= 1 / scale:
+            return f'{seconds * scale:.3f}{unit}'
+    return f'{seconds * 1e9:.1f}ns'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    sys.path[0:0] = [os.getcwd(), os.path.abspath(sys.argv[1])]
+    results = run(sys.argv[1], sys.argv[3] if len(sys.argv) > 3 else '')
+    with open(sys.argv[2], 'w') as f:
+        json.dump(results, f)
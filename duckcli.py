@@ -0,0 +1,863 @@
+''' The duck command line. main.py imports it, so its bytecode is cached
+in __pycache__ instead of compiled again on every start. '''
+
+import os
+import sys
+
+import click
+
+
+# the escape codes of colorama.ansi, without importing colorama (and with it
+# its Windows console support) on every start
+class Fore:
+    RED, GREEN, BLUE, WHITE = '\033[31m', '\033[32m', '\033[34m', '\033[37m'
+
+
+class Style:
+    RESET_ALL = '\033[0m'
+
+
+help = rf'''
+{Fore.BLUE}Quack! Quack! Welcome to ......duck!
+duck is a toolchain for python enthusiasts, with support for, automating scripts, tests, generating lockfiles, 
+generating online documentation for your library, etc.
+Find more at: http://github.com/thisismars-x/duck
+'''
+
+
+class Duck(click.Group):
+    def invoke(self, ctx):
+        # better colors for terminal, once a command actually runs
+        import colorama
+        colorama.init(autoreset=True)
+        if not ctx.params.get('trace'):
+            return super().invoke(ctx)
+
+        import ducktrace
+        name = ' '.join(['duck', *(x for x in sys.argv[1:] if x != '--trace')])
+        ducktrace.start()
+        try:
+            with ducktrace.span(name, 'command'):
+                return super().invoke(ctx)
+        finally:
+            path, summary = ducktrace.finish(name)
+            click.echo(f"{Fore.BLUE}{summary}", err=True)
+
+    def get_help(self, ctx):
+        return super().get_help(ctx) + Style.RESET_ALL
+
+
+@click.group(cls=Duck, help=help)
+@click.option('--trace', is_flag=True, help=f"{Fore.WHITE}Time every phase, subprocess, file and toml access into debug/trace/{Fore.BLUE}")
+def cli(trace):
+    pass
+
+
+@cli.command(help=f"{Fore.WHITE}Initialize empty project{Fore.BLUE}")
+@click.option('-l', '--lib', is_flag=True, help=f'{Fore.WHITE}Initialize an empty library{Fore.BLUE}')
+def init(lib):
+    import shutil
+    import toml
+
+    status = 'n'
+    if os.path.exists('duck.toml'):
+        status = click.prompt(
+            'TOML file already exists. Keep it? [y/n]: ', default='n')
+        if status == 'y' or status == 'Y':
+            os.remove('duck.toml')
+
+    os.makedirs('tests', exist_ok=True)
+    os.makedirs('debug/html', exist_ok=True)
+    config = {
+        'meta': {
+            'name': '<ProjectName>',
+            'version': 0.1,
+                    'author': '<AuthorName>',
+                    'description': '<ProjectDescription>',
+        },
+
+        'dependencies': {
+            'build': [],
+            'release': [],
+        },
+
+        'env': {
+            'path': 'debug/ducky',
+        },
+    }
+
+    config.update({
+        'config': {
+            'tests': 'tests/',
+            'benches': 'benches/',
+            'bench_threshold': 0.1,
+            'snapshots': 5,
+        }
+    })
+
+    if not lib:
+        config['main'] = {'file': 'src/main.py', 'warm': []}
+        os.makedirs('src', exist_ok=True)
+        with open('src/main.py', 'w') as f:
+            f.write("\nprint('Hello, from duck!')")
+    else:
+        os.makedirs('lib', exist_ok=True)
+
+    if (not os.path.exists('duck.toml')) or (status == 'y' or status == 'Y'):
+        with open('duck.toml', 'w') as f:
+            toml.dump(config, f)
+
+    config = toml.load('duck.toml')
+    if config['env']['path'] != 'debug/ducky':
+        import duckenv
+
+        # the clone embeds its own path, so it is built in place and the old
+        # venv is only moved aside until the clone is complete
+        old = f'debug/ducky.duck-{os.getpid()}'
+        if os.path.lexists('debug/ducky'):
+            os.rename('debug/ducky', old)
+        try:
+            files, size, seconds, used = duckenv.clone(config['env']['path'], 'debug/ducky')
+        except BaseException:
+            shutil.rmtree('debug/ducky', ignore_errors=True)
+            if os.path.lexists(old):
+                os.rename(old, 'debug/ducky')
+            raise
+        shutil.rmtree(old, ignore_errors=True)
+        click.echo(f"{Fore.GREEN} Cloned {config['env']['path']} in {seconds:.2f}s: {files} files, "
+                   f"{size / (1 << 20):.1f} MiB ({files / seconds:.0f} files/s, {size / (1 << 20) / seconds:.0f} MiB/s)")
+        click.echo(f"{Fore.WHITE} " + ', '.join(f'{count} {method}' for method, count in sorted(used.items())))
+
+
+@cli.command(help=f"{Fore.WHITE}Generate online documentation{Fore.BLUE}")
+@click.option('-c', '--close', is_flag=True, help=f"{Fore.WHITE}Use with --include to create docs for selected files only{Fore.BLUE}")
+@click.option('-i', '--include', type=str, multiple=True, help=f"{Fore.WHITE}Include these files to your doc{Fore.BLUE}")
+@click.option('-e', '--exclude', type=str, multiple=True, help=f"{Fore.WHITE}Exclude these files from 'src/' directory{Fore.BLUE}")
+@click.option('-d', '--duck', is_flag=True, help=f"{Fore.WHITE}Open your docs in a browser. Call this only after you have called doc before.{Fore.BLUE}")
+@click.option('-o', '--oopen', is_flag=True, help=f"{Fore.WHITE}Compile and open{Fore.BLUE}")
+@click.option('-l', '--library', is_flag=True, help=f'{Fore.WHITE}Create online documentation for your lib/{Fore.BLUE}')
+@click.option('-j', '--jobs', type=int, default=1, help=f'{Fore.WHITE}Parse and render in N processes, 0 for one per core{Fore.BLUE}')
+@click.option('-s', '--sharded', is_flag=True, help=f'{Fore.WHITE}One page per module plus a small index page{Fore.BLUE}')
+@click.option('-w', '--watch', is_flag=True, help=f'{Fore.WHITE}Rebuild on every change and reload the browser{Fore.BLUE}')
+@click.option('-p', '--port', type=int, default=8000, help=f'{Fore.WHITE}Port for --duck and --watch{Fore.BLUE}')
+def doc(library, duck, include, close, exclude, oopen, jobs, sharded, watch, port):
+    import ducker
+
+
+    if library:
+        src = 'lib'
+    else:
+        src = 'src'
+    if oopen or watch:
+        duck = False
+
+    def skipped(path, exc):
+        click.echo(
+            f"Problems with including {path} in documentation. Skipping.", err=True)
+
+    def build(jobs=jobs, memo=None, changed=None):
+        files = [f for f in os.listdir(src) if os.path.isfile(
+            os.path.join(src, f))] if not close else []
+
+        files = sorted(set(files) - set(exclude))
+
+        # the entry module comes first, its docstring describes the project
+        entry = 'main.py' if src == 'src' else 'lib.py'
+        if entry in files:
+            files.remove(entry)
+            files.insert(0, entry)
+
+        def paths():
+            for file in files:
+                yield f'{src}/{file}'
+            yield from include
+
+        ducker.build_docs(paths(), 'debug/html', on_error=skipped,
+                          jobs=jobs or os.cpu_count(), sharded=sharded, memo=memo, changed=changed)
+
+    # a long-lived --watch process keeps parsed modules in memory between builds
+    memo = {} if watch else None
+    if not duck:
+        build(memo=memo)
+
+    if oopen or watch:
+        duck = True
+    if duck:
+        if not os.path.exists(f'debug/html/index.html'):
+            click.echo(
+                "Could not generate docs: call duck doc (--include, --exclude, --close) to generate html first", err=True)
+            return
+        import time
+        import webbrowser
+        import duckserve
+
+        reloader = duckserve.Reloader()
+        try:
+            server = duckserve.serve('debug/html', port, reloader)
+        except OSError as e:
+            click.echo(f"{Fore.RED} Could not serve on port {port}: {e}", err=True)
+            return
+        url = f'http://127.0.0.1:{port}/'
+        click.echo(f"{Fore.GREEN} Serving debug/html at {url}" + (f", watching {src}/" if watch else ''))
+        webbrowser.open(url)
+        try:
+            if not watch:
+                while True:
+                    time.sleep(3600)
+            for changed in duckserve.changes([src], include):
+                start = time.perf_counter()
+                build(jobs=1, memo=memo, changed=changed)
+                reloader.notify()
+                click.echo(f"{Fore.BLUE} Rebuilt {', '.join(sorted(changed))} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+@cli.command(help=f"{Fore.WHITE}Run default scripts{Fore.BLUE}")
+@click.argument('argss', default='')
+@click.option('-p', '--profile', is_flag=True, help=f"{Fore.WHITE}Profile the run with cProfile and print the hottest functions{Fore.BLUE}")
+@click.option('-s', '--sample', is_flag=True, help=f"{Fore.WHITE}Profile with the sampling profiler and export collapsed stacks for flame graphs{Fore.BLUE}")
+@click.option('--interval', type=float, default=0.005, help=f"{Fore.WHITE}Seconds of CPU time between samples for --sample{Fore.BLUE}")
+@click.option('-t', '--import-time', is_flag=True, help=f"{Fore.WHITE}Table of per-module import cost from -X importtime{Fore.BLUE}")
+@click.option('-m', '--memprofile', is_flag=True, help=f"{Fore.WHITE}Track allocations with tracemalloc, snapshot on --every and on SIGUSR1{Fore.BLUE}")
+@click.option('--every', type=float, default=0, help=f"{Fore.WHITE}Seconds between --memprofile snapshots, 0 for only SIGUSR1 and exit{Fore.BLUE}")
+@click.option('--baseline', type=str, default=None, help=f"{Fore.WHITE}Earlier .memory.json report (or 'last') to diff --memprofile against{Fore.BLUE}")
+@click.option('--top', type=int, default=20, help=f"{Fore.WHITE}Rows in each profile table{Fore.BLUE}")
+@click.option('-w', '--warm', is_flag=True, help=f"{Fore.WHITE}Run in a fork of a daemon that keeps [main] warm modules imported{Fore.BLUE}")
+@click.option('--restart', is_flag=True, help=f"{Fore.WHITE}Stop the warm daemon first, so it imports everything again{Fore.BLUE}")
+def run(argss, profile, sample, interval, import_time, memprofile, every, baseline, top, warm, restart):
+    import subprocess
+    import toml
+
+    try:
+        cwd = os.getcwd().split('src')[0]
+        config = toml.load(f'{cwd}/duck.toml')['main']
+        file = config['file']
+    except:
+        click.echo(
+            "Problem finding file under 'main' header in duck.toml", err=True)
+        return
+
+    args = [argss] if argss else []
+    if warm or restart:
+        import duckwarm
+
+        modules = config.get('warm', [])
+        path = duckwarm.socket_path(cwd, file, modules)
+        if restart and duckwarm.stop(path):
+            click.echo(f"{Fore.BLUE} Stopped the warm interpreter", err=True)
+        if warm:
+            try:
+                sys.exit(duckwarm.run(file, args, os.path.abspath(cwd), modules))
+            except OSError as exc:
+                click.echo(f"{Fore.RED} {exc}", err=True)
+                sys.exit(1)
+        return
+
+    if not (profile or sample or import_time or memprofile):
+        subprocess.run([sys.executable, file, *args], cwd=cwd)
+        return
+
+    import duckprof
+
+    out_dir = os.path.join(cwd, duckprof.PROFILE_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(file))[0]
+    name = f"{stem}-{duckprof.stamp()}"
+
+    if import_time:
+        result = subprocess.run([sys.executable, '-X', 'importtime', file, *args],
+                                cwd=cwd, stderr=subprocess.PIPE, text=True)
+        rows, other = duckprof.parse_importtime(result.stderr)
+        if other:
+            click.echo('\n'.join(other), err=True)
+        report = os.path.join(out_dir, f'{name}.importtime.txt')
+        with open(report, 'w') as f:
+            f.write(result.stderr)
+        rows.sort(key=lambda x: (-x[1], x[3]))
+        click.echo(f"{Fore.BLUE} {'cumulative':>12} {'self':>10}  module")
+        for own, cumulative, depth, module in rows[:top]:
+            click.echo(f"{Fore.WHITE} {cumulative / 1000:>10.1f}ms {own / 1000:>8.1f}ms  {'  ' * depth}{module}")
+        total = sum(own for own, _, _, _ in rows)
+        click.echo(f"{Fore.GREEN} {len(rows)} modules, {total / 1000:.1f}ms importing. Raw output: {report}")
+        return
+
+    if memprofile:
+        raw = os.path.join(out_dir, f'{name}.memory.json')
+        here = os.path.dirname(os.path.abspath(__file__))
+        proc = subprocess.Popen([sys.executable, os.path.join(here, 'duckprof.py'), 'memory', raw, str(every), file, *args], cwd=cwd)
+        click.echo(f"{Fore.BLUE} Send SIGUSR1 to {proc.pid} for a snapshot (kill -USR1 {proc.pid})", err=True)
+        try:
+            proc.wait()
+        except KeyboardInterrupt:
+            proc.wait()
+        if not os.path.exists(raw):
+            click.echo(f"{Fore.RED} No memory report was written", err=True)
+            return
+        report = duckprof.read_memory(raw)
+        size = duckprof.size
+
+        click.echo(f"\n{Fore.BLUE} {'seconds':>9} {'traced':>10} {'peak':>10} {'rss':>10}  snapshot")
+        for snap in report['snapshots']:
+            click.echo(f"{Fore.WHITE} {snap['time']:>9.2f} {size(snap['traced']):>10} {size(snap['traced_peak']):>10} "
+                       f"{size(snap['rss']) if snap['rss'] else '-':>10}  {snap['reason']}")
+        final = report['snapshots'][-1]
+        when = 'at exit' if final['reason'] == 'exit' else f"at the last snapshot ({final['reason']}), the script did not finish"
+        click.echo(f"\n{Fore.BLUE} Top {min(top, len(final['sites']))} allocation sites {when}")
+        click.echo(f"{Fore.BLUE} {'size':>10} {'blocks':>8}  site")
+        for site, total, count in final['sites'][:top]:
+            click.echo(f"{Fore.WHITE} {size(total):>10} {count:>8}  {site}")
+        growth = final.get('growth_total')
+        if growth:
+            click.echo(f"\n{Fore.BLUE} Top {min(top, len(growth))} growth since the first snapshot")
+            click.echo(f"{Fore.BLUE} {'growth':>10} {'size':>10} {'blocks':>8}  site")
+            for site, diff, total, count_diff in growth[:top]:
+                click.echo(f"{Fore.WHITE} {size(diff):>10} {size(total):>10} {count_diff:>+8}  {site}")
+
+        if baseline == 'last':
+            baseline = duckprof.latest_memory(out_dir, stem, exclude=raw)
+            if not baseline:
+                click.echo(f"{Fore.RED} No earlier memory report to compare with", err=True)
+        if baseline:
+            try:
+                rows = duckprof.memory_diff(duckprof.read_memory(baseline), report, top)
+            except (OSError, ValueError, KeyError, IndexError):
+                click.echo(f"{Fore.RED} Could not read {baseline}", err=True)
+            else:
+                click.echo(f"\n{Fore.BLUE} Change at exit against {baseline}")
+                click.echo(f"{Fore.BLUE} {'change':>10} {'before':>10} {'after':>10}  site")
+                for site, before, after in rows:
+                    click.echo(f"{Fore.WHITE} {size(after - before):>10} {size(before):>10} {size(after):>10}  {site}")
+        peak = report.get('peak_rss')
+        click.echo(f"\n{Fore.GREEN} Peak RSS {size(peak) if peak else 'unknown'}. Report: {raw}")
+        return
+
+    if sample:
+        raw = os.path.join(out_dir, f'{name}.collapsed')
+        here = os.path.dirname(os.path.abspath(__file__))
+        subprocess.run([sys.executable, os.path.join(here, 'duckprof.py'), 'sample', raw, str(interval), file, *args], cwd=cwd)
+        if not os.path.exists(raw):
+            click.echo(f"{Fore.RED} No samples were written", err=True)
+            return
+        stacks = duckprof.read_collapsed(raw)
+        cumulative, own = duckprof.sample_tables(stacks, duckprof.cpu_seconds(raw, stacks, interval), top)
+        columns, fmt = f"{'seconds':>10} {'share':>7}", lambda row: f"{row[0]:>10.3f} {row[1]:>6.1%}"
+    else:
+        raw = os.path.join(out_dir, f'{name}.prof')
+        subprocess.run([sys.executable, '-m', 'cProfile', '-o', raw, file, *args], cwd=cwd)
+        if not os.path.exists(raw):
+            click.echo(f"{Fore.RED} No profile was written", err=True)
+            return
+        cumulative, own = duckprof.profile_tables(raw, top)
+        columns, fmt = f"{'seconds':>10} {'calls':>9}", lambda row: f"{row[0]:>10.3f} {row[1]:>9}"
+
+    for title, rows in (('cumulative', cumulative), ('self', own)):
+        click.echo(f"\n{Fore.BLUE} Top {len(rows)} by {title} time")
+        click.echo(f"{Fore.BLUE} {columns}  function")
+        for row in rows:
+            click.echo(f"{Fore.WHITE} {fmt(row)}  {row[2]}")
+    click.echo(f"\n{Fore.GREEN} Raw profile: {raw}")
+
+
+@cli.command(help=f"{Fore.WHITE}Run tests from tests/{Fore.BLUE}")
+@click.option('-i', '--include', type=str, multiple=True, help=f"{Fore.WHITE}Run tests by including only these files from tests/{Fore.BLUE}")
+@click.option('-j', '--jobs', type=int, default=1, help=f"{Fore.WHITE}Split tests over N workers by recorded duration, 0 for one per core{Fore.BLUE}")
+@click.option('-n', '--no-cache', is_flag=True, help=f"{Fore.WHITE}Run every test, even if nothing it depends on changed{Fore.BLUE}")
+@click.option('--serve', is_flag=True, help=f"{Fore.WHITE}Start a test server that keeps pytest and imports warm for later runs{Fore.BLUE}")
+@click.option('--stop', is_flag=True, help=f"{Fore.WHITE}Stop the test server{Fore.BLUE}")
+def test(include, jobs, no_cache, serve, stop):
+    import ducktest
+
+    cwd = os.getcwd().split('tests')[0]
+    targets = list(include) if include else ['tests/']
+    jobs = jobs or os.cpu_count()
+
+    if stop:
+        try:
+            stopped = ducktest.stop_server(cwd)
+        except OSError as exc:
+            click.echo(f"{Fore.RED} {exc}", err=True)
+            sys.exit(1)
+        click.echo(f"{Fore.GREEN} Stopped the test server" if stopped else f"{Fore.BLUE} No test server was running")
+        return
+    if serve:
+        click.echo(f"{Fore.BLUE} Starting the test server, collecting {' '.join(targets)}...")
+        try:
+            started = ducktest.start_server(targets, os.path.abspath(cwd))
+        except OSError as exc:
+            click.echo(f"{Fore.RED} {exc}", err=True)
+            sys.exit(1)
+        click.echo(f"{Fore.GREEN} Test server ready, `duck test` now runs through it" if started
+                   else f"{Fore.BLUE} The test server is already running")
+        return
+
+    targets, cached, state = ducktest.split(targets, cwd, cache=not no_cache)
+    results = {}
+    for found in cached.values():
+        results.update(found)
+    if cached:
+        click.echo(f"{Fore.BLUE} {len(cached)} test files unchanged since they last passed, "
+                   f"{len(results)} cached results (--no-cache to rerun)")
+    if not targets:
+        click.echo(f"{Fore.GREEN} ========== {ducktest.tally(results) or 'no tests'} (cached) ==========")
+        return
+
+    code, outputs, ran, elapsed = (ducktest.served(targets, jobs, cwd=os.path.abspath(cwd))
+                                   or ducktest.run(targets, jobs, cwd=cwd))
+    ducktest.remember(state, ran, cwd)
+    results.update(ran)
+    if jobs > 1 or cached:
+        for i, (output, status) in enumerate(outputs):
+            if output:
+                click.echo(f"{Fore.BLUE} ---------- worker {i} (exit {status}) ----------")
+                click.echo(output.rstrip())
+        summary = ducktest.tally(results) or 'no tests ran'
+        color = Fore.GREEN if code in (0, 5) else Fore.RED
+        click.echo(f"{color} ========== {summary} in {elapsed:.2f}s over {jobs} workers, "
+                   f"{sum(len(x) for x in cached.values())} cached ==========")
+    sys.exit(0 if code == 5 and cached else code)
+
+
+@cli.command(help=f"{Fore.WHITE}Run benchmarks from benches/{Fore.BLUE}")
+@click.option('-k', '--filter', 'pattern', type=str, default='', help=f"{Fore.WHITE}Only benchmarks whose name contains this{Fore.BLUE}")
+@click.option('-c', '--compare', type=str, default='', help=f"{Fore.WHITE}Compare with a stored run: --save name, run id, git ref (rev, branch, tag, HEAD~1) or 'last'{Fore.BLUE}")
+@click.option('-t', '--threshold', type=float, default=None, help=f"{Fore.WHITE}Allowed slowdown before failing, 0.1 for 10%{Fore.BLUE}")
+@click.option('-s', '--save', type=str, default='', help=f"{Fore.WHITE}Name this run in the history{Fore.BLUE}")
+def bench(pattern, compare, threshold, save):
+    import json
+    import subprocess
+    import time
+    import toml
+    import duckbench
+
+    config = toml.load('duck.toml').get('config', {}) if os.path.exists('duck.toml') else {}
+    benches = config.get('benches', 'benches/')
+    if threshold is None:
+        threshold = float(config.get('bench_threshold', 0.1))
+    if not os.path.isdir(benches):
+        click.echo(f"{Fore.RED} No {benches} directory, see 'benches' under [config] in duck.toml", err=True)
+        sys.exit(2)
+
+    runs = duckbench.history()
+    reference = None
+    if compare:
+        reference = duckbench.find(runs, compare, os.getcwd())
+        if not reference:
+            click.echo(f"{Fore.RED} No stored benchmark run matches <{compare}>", err=True)
+            sys.exit(2)
+
+    os.makedirs(os.path.dirname(duckbench.HISTORY), exist_ok=True)
+    out = os.path.join(os.path.dirname(duckbench.HISTORY), 'current.json')
+    here = os.path.dirname(os.path.abspath(__file__))
+    status = subprocess.run([sys.executable, os.path.join(here, 'duckbench.py'), benches, out, pattern]).returncode
+    if status:
+        click.echo(f"{Fore.RED} Benchmarks failed to run", err=True)
+        sys.exit(status)
+    with open(out, 'r') as f:
+        results = json.load(f)
+    os.remove(out)
+
+    run = {'id': time.strftime('%Y%m%d-%H%M%S'), 'name': save or None,
+           'rev': duckbench.revision(os.getcwd()), 'results': results}
+    duckbench.record(run)
+
+    click.echo(f"{Fore.BLUE} {'benchmark':<40} {'median':>12} {'p10':>12} {'p90':>12} {'iterations':>11}")
+    for name, r in results.items():
+        click.echo(f"{Fore.WHITE} {name:<40} {duckbench.units(r['median']):>12} "
+                   f"{duckbench.units(r['p10']):>12} {duckbench.units(r['p90']):>12} {r['iterations']:>11}")
+
+    if reference:
+        label = reference.get('name') or reference.get('rev') or reference['id']
+        click.echo(f"\n{Fore.BLUE} Compared with {label} (threshold {threshold:.0%})")
+        regressions = 0
+        for name, before, after, ratio, regressed in duckbench.compare(results, reference['results'], threshold):
+            color = Fore.RED if regressed else (Fore.GREEN if ratio < 1 - threshold else Fore.WHITE)
+            click.echo(f"{color} {name:<40} {duckbench.units(before):>12} -> {duckbench.units(after):>12} {ratio:>7.2f}x")
+            regressions += regressed
+        if regressions:
+            click.echo(f"{Fore.RED} {regressions} benchmarks slowed down past the threshold", err=True)
+            sys.exit(1)
+
+
+@cli.command(help=f"{Fore.WHITE}Inspect your dependency tree{Fore.BLUE}")
+@click.option('-l', '--level', default=1, help=f'{Fore.WHITE}Depth of the dependency tree. --level=2 to also list what each package requires.{Fore.BLUE}')
+@click.option('-c', '--core', is_flag=True, help=f'{Fore.WHITE}Without duck dependencies{Fore.BLUE}')
+@click.option('-n', '--no-cache', is_flag=True, help=f'{Fore.WHITE}Rebuild the graph even if the environment did not change{Fore.BLUE}')
+@click.option('-j', '--json', 'as_json', is_flag=True, help=f'{Fore.WHITE}Print the whole graph as JSON{Fore.BLUE}')
+def tree(level, core, no_cache, as_json):
+    import json
+    import duckdeps
+
+    core_dep = ['toml', 'click', 'colorama', 'pyfiglet',
+                'pytest', 'iniconfig', 'packaging', 'pluggy']
+    l = max(level, 1)
+
+    graph = duckdeps.Graph(duckdeps.load_graph(cache=not no_cache))
+    if as_json:
+        click.echo(json.dumps({'roots': graph.roots(), 'packages': graph.to_json()}, indent=2))
+        return
+
+    def branch(package, depth, seen):
+        lines = []
+        for dep in graph.requires[package]:
+            pad = '    |' * depth
+            if dep not in graph.nodes:
+                lines.append(f"{Fore.GREEN} |{pad}--> {Fore.RED}{graph.label(dep)}")
+                continue
+            lines.append(f"{Fore.GREEN} |{pad}--> {Fore.BLUE}{graph.label(dep)}")
+            if depth + 1 < l and dep not in seen:
+                lines += branch(dep, depth + 1, seen | {dep})
+        return lines
+
+    res_tree = []
+    for package in graph.roots():
+        if core and package in core_dep:
+            continue
+        res_tree.append(f"{Fore.GREEN} |-------> {Fore.WHITE}{graph.label(package)}")
+        if l >= 2:
+            res_tree += branch(package, 1, {package})
+            res_tree.append(f"{Fore.GREEN} |")
+    if l >= 2:
+        res_tree.append(
+            f'\n{Fore.BLUE} Blue dependencies are required by upper white dependencies')
+
+    click.echo('\n'.join(res_tree))
+
+
+@cli.command(help=f"{Fore.WHITE}Find where a class, function or method is defined{Fore.BLUE}")
+@click.argument('name')
+@click.option('-k', '--kind', type=click.Choice(['module', 'class', 'function', 'method']), default=None, help=f'{Fore.WHITE}Only symbols of this kind{Fore.BLUE}')
+@click.option('-l', '--limit', type=int, default=50, help=f'{Fore.WHITE}Most results to show{Fore.BLUE}')
+@click.option('-d', '--doc', is_flag=True, help=f'{Fore.WHITE}Show the first line of each docstring{Fore.BLUE}')
+@click.option('-j', '--json', 'as_json', is_flag=True, help=f'{Fore.WHITE}Print matches as JSON{Fore.BLUE}')
+@click.option('--jobs', type=int, default=0, help=f'{Fore.WHITE}Processes for parsing many changed files, 0 for one per core{Fore.BLUE}')
+def find(name, kind, limit, doc, as_json, jobs):
+    import json
+    import duckindex
+
+    # the project root is the nearest directory with a duck.toml
+    root = os.getcwd()
+    while not os.path.exists(os.path.join(root, 'duck.toml')) and os.path.dirname(root) != root:
+        root = os.path.dirname(root)
+    if not os.path.exists(os.path.join(root, 'duck.toml')):
+        root = os.getcwd()
+
+    db = duckindex.connect(os.path.join(root, duckindex.INDEX))
+    parsed, removed, failed = duckindex.update(db, root, jobs or os.cpu_count())
+    for path in failed:
+        click.echo(f"{Fore.RED} Could not parse {path}, its symbols are left out", err=True)
+    rows = duckindex.find(db, name, kind, limit)
+
+    if as_json:
+        keys = ('file', 'line', 'kind', 'qualname', 'signature', 'doc')
+        click.echo(json.dumps([dict(zip(keys, row)) for row in rows], indent=2))
+        return
+    if not rows:
+        click.echo(f"{Fore.RED} Nothing named {name}", err=True)
+        sys.exit(1)
+    for path, line, found_kind, qualname, sig, docstring in rows:
+        click.echo(f"{Fore.WHITE}{path}:{line}  {Fore.BLUE}{found_kind:<8} {Fore.WHITE}{qualname}  {Fore.BLUE}{sig}")
+        if doc and docstring:
+            click.echo(f"    {docstring.strip().splitlines()[0]}")
+    if parsed or removed:
+        click.echo(f"{Fore.BLUE} (indexed {len(parsed)} changed files, dropped {len(removed)})", err=True)
+
+
+@cli.command(help=f"{Fore.WHITE}Show why a package is installed{Fore.BLUE}")
+@click.argument('pkg')
+@click.option('-j', '--json', 'as_json', is_flag=True, help=f'{Fore.WHITE}Print the paths as JSON{Fore.BLUE}')
+@click.option('-n', '--no-cache', is_flag=True, help=f'{Fore.WHITE}Rebuild the graph even if the environment did not change{Fore.BLUE}')
+def why(pkg, as_json, no_cache):
+    import json
+    import toml
+    import duckdeps
+
+    graph = duckdeps.Graph(duckdeps.load_graph(cache=not no_cache))
+    target = duckdeps.canonical(pkg)
+
+    top = []
+    if os.path.exists('duck.toml'):
+        deps = toml.load('duck.toml').get('dependencies', {})
+        for spec in deps.get('build', []) + deps.get('release', []):
+            name = duckdeps.requirement_name(spec)
+            if name not in top:
+                top.append(name)
+
+    paths = graph.paths(target, top)
+    if as_json:
+        click.echo(json.dumps({
+            'package': target,
+            'installed': target in graph.nodes,
+            'version': graph.nodes[target]['version'] if target in graph.nodes else None,
+            'top_level': top,
+            'required_by': sorted(graph.required_by.get(target, [])),
+            'paths': paths,
+        }, indent=2))
+        return
+
+    if target not in graph.nodes:
+        click.echo(f"{Fore.RED} <{pkg}> is not installed", err=True)
+        return
+    if not paths:
+        parents = ', '.join(graph.label(x) for x in sorted(graph.required_by.get(target, [])))
+        click.echo(f"{Fore.RED} <{pkg}> is not required by any dependency in duck.toml")
+        if parents:
+            click.echo(f"{Fore.BLUE} Required by: {parents}")
+        return
+
+    for path in paths:
+        click.echo(f"{Fore.GREEN} |-------> " + f'{Fore.GREEN} -> '.join(
+            f"{Fore.WHITE if key == path[0] else Fore.BLUE}{graph.label(key)}" for key in path))
+
+
+@cli.command(help=f"{Fore.WHITE}Generate lockfile{Fore.BLUE}")
+@click.option('-f', '--force', is_flag=True, help=f'{Fore.WHITE}Rewrite freeze.txt even if the environment did not change{Fore.BLUE}')
+def lock(force):
+    import duckdeps
+
+    if duckdeps.lock('freeze.txt', force=force):
+        click.echo(f"{Fore.GREEN} freeze.txt updated")
+    else:
+        click.echo(f"{Fore.GREEN} freeze.txt is up to date")
+
+
+@cli.command(help=f"{Fore.WHITE}Upgrade packages{Fore.BLUE}")
+@click.option('-p', '--pkg', type=str, multiple=True, help=f'{Fore.WHITE}Package to upgrade, repeat to upgrade several in one transaction (pkg or pkg==version){Fore.BLUE}')
+@click.option('-v', '--version', type=str, default='', help=f'{Fore.WHITE}Version after upgrading, with a single --pkg{Fore.BLUE}')
+def upgrade(pkg, version):
+    import shutil
+    import subprocess
+    import toml
+    import duckdeps
+    import duckenv
+    import ducktrace
+
+    if not pkg:
+        click.echo(f"{Fore.RED} Specify pkg name, see duck upgrade --help")
+        return
+    if version and len(pkg) > 1:
+        click.echo(f"{Fore.RED} --version needs a single --pkg, pin the others as pkg==version")
+        return
+
+    if not duckenv.in_venv():
+        click.echo(f"{Fore.RED} duck upgrade snapshots the environment, activate the project's virtual environment (debug/ducky) first", err=True)
+        sys.exit(1)
+
+    specs = [f'{pkg[0]}=={version}'] if version else list(pkg)
+    loose = [x for x in specs if duckdeps.pinned(x)[1] is None]
+    if loose:
+        status = click.prompt(
+            f"{Fore.RED}It's dangerous to upgrade without specifying version ({', '.join(loose)}).\nDo you wish to continue? [y/n]", default='n')
+        if status == 'n' or status == 'N':
+            click.echo(
+                f"{Fore.GREEN} No versions upgraded.. your lockfiles are safe")
+            return
+
+    try:
+        keep = int(toml.load('duck.toml')['config'].get('snapshots', duckenv.KEEP))
+    except (OSError, KeyError, ValueError, toml.TomlDecodeError):
+        keep = duckenv.KEEP
+    with ducktrace.span('snapshot'):
+        snap = duckenv.snapshot(f"upgrade {' '.join(specs)}", 'freeze.txt', keep=keep)
+    click.echo(f"{Fore.BLUE} Snapshot {snap['id']}: {snap['files']} files in {snap['seconds']:.2f}s")
+
+    with ducktrace.span('pip install'):
+        status = subprocess.run(['pip', 'install', '--upgrade', *specs]).returncode
+    if status:
+        with ducktrace.span('restore'):
+            seconds = duckenv.restore(snap)
+        shutil.rmtree(snap['path'], ignore_errors=True)
+        click.echo(f"{Fore.RED} No package satisfies {', '.join(specs)}, "
+                   f"environment rolled back to {snap['id']} in {seconds:.2f}s", err=True)
+        sys.exit(status)
+
+    with ducktrace.span('lock'):
+        duckdeps.lock('freeze.txt')
+    now = {key: dist.version for key, dist in duckdeps.installed().items()}
+    for name, (old, new) in duckenv.changes(snap['packages'], now).items():
+        click.echo(f"{Fore.BLUE} <{name}> @{old or '-'} -> @{new or '-'}")
+    click.echo(f"{Fore.GREEN} Upgraded, `duck rollback` restores {snap['id']}")
+
+
+@cli.command(help=f"{Fore.WHITE}Undo the last upgrade from its snapshot{Fore.BLUE}")
+@click.option('-l', '--list', 'listing', is_flag=True, help=f'{Fore.WHITE}List the snapshots that can be restored{Fore.BLUE}')
+@click.option('-t', '--to', type=str, default='', help=f'{Fore.WHITE}Restore this snapshot id instead of the newest{Fore.BLUE}')
+def rollback(listing, to):
+    import shutil
+    import duckdeps
+    import duckenv
+    import ducktrace
+
+    snaps = duckenv.snapshots()
+    if listing:
+        for snap in snaps:
+            click.echo(f"{Fore.WHITE} {snap['id']}  {snap['created']}  {snap['reason']}")
+        if not snaps:
+            click.echo(f"{Fore.BLUE} No snapshots in {duckenv.SNAPSHOT_DIR}")
+        return
+
+    found = [s for s in snaps if s['id'] == to] if to else snaps[-1:]
+    if not found:
+        click.echo(f"{Fore.RED} No snapshot {to or 'to roll back to'}, see duck rollback --list", err=True)
+        sys.exit(1)
+    snap = found[0]
+    if not duckenv.in_venv():
+        click.echo(f"{Fore.RED} duck rollback only swaps a virtual environment, activate the one {snap['id']} came from", err=True)
+        sys.exit(1)
+    before = {key: dist.version for key, dist in duckdeps.installed().items()}
+    with ducktrace.span('restore'):
+        seconds = duckenv.restore(snap)
+    # the restored snapshot is consumed, like an undo step (the next rollback
+    # goes one further back), and everything newer describes an undone state
+    for later in snaps[snaps.index(snap):]:
+        shutil.rmtree(later['path'], ignore_errors=True)
+    for name, (old, new) in duckenv.changes(before, snap['packages']).items():
+        click.echo(f"{Fore.BLUE} <{name}> @{old or '-'} -> @{new or '-'}")
+    click.echo(f"{Fore.GREEN} Restored {snap['id']} ({snap['reason']}) in {seconds:.2f}s")
+
+
+@cli.command(help=f"{Fore.WHITE}Add new packages{Fore.BLUE}")
+@click.option('-p', '--pkg', type=str, help=f'{Fore.WHITE}<pkg> to be installed{Fore.BLUE}')
+@click.option('-r', '--release', is_flag=True, help=f'{Fore.WHITE}Bundle in release mode{Fore.BLUE}')
+@click.option('-n', '--no-store', is_flag=True, help=f'{Fore.WHITE}Always install through pip, bypassing the shared package store{Fore.BLUE}')
+def add(pkg, release, no_store):
+    import subprocess
+    import toml
+
+    try:
+        if no_store:
+            subprocess.run(['pip', 'install', pkg])
+        else:
+            import duckstore
+            linked, _, _, _ = duckstore.install([pkg])
+            if linked:
+                click.echo(f"{Fore.BLUE} Linked {', '.join(linked)} from {duckstore.STORE}")
+        config = toml.load('duck.toml')
+        if not release:
+            config['dependencies']['build'].append(pkg)
+            config['dependencies']['build'] = list(
+                set(config['dependencies']['build']))
+        else:
+            config['dependencies']['release'].append(pkg)
+            config['dependencies']['release'] = list(
+                set(config['dependencies']['release']))
+
+        with open('duck.toml', 'w') as f:
+            toml.dump(config, f)
+    except:
+        click.echo(f"{Fore.RED}Could not get- <{pkg}>")
+
+
+@cli.command(help=f"{Fore.WHITE}Show or fill the shared package store{Fore.BLUE}")
+@click.option('-i', '--ingest', is_flag=True, help=f'{Fore.WHITE}Import every package of the active environment into the store{Fore.BLUE}')
+def store(ingest):
+    import duckdeps
+    import duckstore
+
+    if ingest:
+        dists = duckdeps.installed()
+        done = [key for key, dist in sorted(dists.items())
+                if key not in duckdeps.FREEZE_SKIP and duckstore.ingest(dist)]
+        click.echo(f"{Fore.GREEN} Stored {len(done)} of {len(dists)} packages")
+
+    count, objects, size, shared = duckstore.stats()
+    click.echo(f"{Fore.BLUE} {duckstore.STORE}")
+    click.echo(f"{Fore.WHITE} {count} packages, {objects} files, {size / (1 << 20):.1f} MiB, "
+               f"{shared} files linked into at least one environment")
+
+
+@cli.command(help=f"{Fore.WHITE}Inherit dependencies from another project{Fore.BLUE}")
+@click.option('-r', '--release', is_flag=True, help=f'{Fore.WHITE}Install packages for your released mode only{Fore.BLUE}')
+@click.option('-w', '--wheelhouse', type=str, default='', help=f'{Fore.WHITE}Local directory of wheels to install from (and download into){Fore.BLUE}')
+@click.option('-j', '--jobs', type=int, default=1, help=f'{Fore.WHITE}Parallel downloads into --wheelhouse{Fore.BLUE}')
+@click.option('-o', '--offline', is_flag=True, help=f'{Fore.WHITE}Install from --wheelhouse only, never touch the index{Fore.BLUE}')
+@click.option('-n', '--no-store', is_flag=True, help=f'{Fore.WHITE}Always install through pip, bypassing the shared package store{Fore.BLUE}')
+def inherit(release, wheelhouse, jobs, offline, no_store):
+    import concurrent.futures
+    import subprocess
+    import toml
+    import duckdeps
+    import duckstore
+    import ducktrace
+
+    timings = []
+    with ducktrace.span('diff') as phase:
+        with open('freeze.txt', 'r') as f:
+            from_lockfile = f.read().splitlines()
+        if release:
+            config = toml.load('duck.toml')['dependencies']['release']
+            names = {duckdeps.requirement_name(x) for x in config}
+            from_lockfile = [x for x in from_lockfile
+                             if duckdeps.pinned(x)[0] in names]
+
+        pending, editable, unchanged, changes = duckdeps.delta(from_lockfile)
+        mismatched = duckdeps.mismatched(unchanged)
+    timings.append(('diff', phase.seconds))
+
+    for name, locked, current in mismatched:
+        click.echo(f"{Fore.RED} <{name}> is installed from another build than freeze.txt locked "
+                   f"(sha256 {current[:12]}, locked {locked[:12]}), `pip install --force-reinstall` it to replace it", err=True)
+
+    if not pending and not editable:
+        click.echo(f"{Fore.GREEN} Nothing to install, {len(unchanged)} packages already match freeze.txt")
+        return
+
+    linked = []
+    if not no_store:
+        with ducktrace.span('link') as phase:
+            manifests, pending = duckstore.plan(pending, deps=release)
+            for manifest in manifests:
+                duckstore.link(manifest)
+                linked.append(duckstore.label(manifest))
+        timings.append(('link', phase.seconds))
+
+    if wheelhouse and not offline and pending:
+        with ducktrace.span('fetch') as phase:
+            os.makedirs(wheelhouse, exist_ok=True)
+            jobs = max(1, min(jobs, len(pending)))
+            chunks = [pending[i::jobs] for i in range(jobs)]
+
+            def fetch(chunk):
+                return subprocess.run(['pip', 'download', '--quiet', '--no-deps', '--find-links', wheelhouse,
+                                       '--dest', wheelhouse] + chunk).returncode
+
+            with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+                if any(list(pool.map(fetch, chunks))):
+                    click.echo(f"{Fore.RED} Some packages could not be downloaded to {wheelhouse}", err=True)
+        timings.append(('fetch', phase.seconds))
+
+    status = 0
+    if pending or editable:
+        with ducktrace.span('install') as phase:
+            before = duckstore.versions()
+            # freeze.txt already pins the full closure, so the resolver has nothing to add
+            cmd = ['pip', 'install', '--quiet'] + ([] if release else ['--no-deps'])
+            if wheelhouse:
+                cmd += ['--find-links', wheelhouse]
+            if offline:
+                cmd += ['--no-index']
+            if pending:
+                status = subprocess.run(cmd + pending).returncode
+            # editables build from their source, each on its own so one that
+            # fails cannot take the pinned packages or the others down with it
+            for url in editable:
+                status = subprocess.run(cmd + ['-e', url]).returncode or status
+            if not no_store:
+                duckstore.remember(before)
+        timings.append(('install', phase.seconds))
+
+    for name, (old, new, spec) in sorted(changes.items()):
+        if old is None:
+            click.echo(f"{Fore.GREEN} Added <{spec}>")
+        else:
+            click.echo(f"{Fore.BLUE} Changed <{name}> @{old} -> @{new}")
+    for url in editable:
+        click.echo(f"{Fore.GREEN} Added editable <{url}>")
+    if linked:
+        click.echo(f"{Fore.BLUE} Linked {len(linked)} from {duckstore.STORE}, {len(pending) + len(editable)} through pip")
+    click.echo(f"{Fore.WHITE} {len(changes) + len(editable)} changed, {len(unchanged)} unchanged")
+    click.echo(f"{Fore.WHITE} " + ', '.join(f'{phase} {sec:.2f}s' for phase, sec in timings))
+    if status:
+        click.echo(f"{Fore.RED} pip install failed, see the output above", err=True)
+        sys.exit(status)
+
@@ -0,0 +1,404 @@
+''' Installed-package metadata for duck, read in process.
+
+Everything here works from the distributions visible on sys.path (the active
+environment) through importlib.metadata, so no pip subprocess is needed to
+inspect what is installed. '''
+
+import hashlib
+import json
+import os
+import re
+import sys
+from importlib import metadata
+
+import ducktrace
+
+try:
+    from packaging.markers import UndefinedEnvironmentName
+    from packaging.requirements import InvalidRequirement, Requirement
+    from packaging.specifiers import SpecifierSet
+    from packaging.version import InvalidVersion, Version
+except ImportError:
+    # a fresh venv (duck-hatch) has no packaging yet, but pip vendors it
+    from pip._vendor.packaging.markers import UndefinedEnvironmentName
+    from pip._vendor.packaging.requirements import InvalidRequirement, Requirement
+    from pip._vendor.packaging.specifiers import SpecifierSet
+    from pip._vendor.packaging.version import InvalidVersion, Version
+
+CACHE_DIR = 'debug/cache'
+IGNORED = ['pip', 'pip3', 'setuptools']
+
+
+def canonical(name):
+    ''' PEP 503 normalized name, so `Foo_Bar` and `foo-bar` are one package '''
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def site_dirs():
+    return [p for p in sys.path if p and os.path.isdir(p)]
+
+
+def fingerprint():
+    ''' Cheap digest of every installed distribution: dist-info names and mtimes.
+    Changes whenever a package is installed, removed or upgraded. '''
+    digest = hashlib.sha256(f'{sys.executable}\n{sys.version}\n'.encode())
+    for path in site_dirs():
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.endswith(('.dist-info', '.egg-info')):
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+                digest.update(f'{path}/{entry.name}:{mtime}\n'.encode())
+    return digest.hexdigest()
+
+
+def installed():
+    ''' {canonical name: Distribution} of the active environment, first one on sys.path wins '''
+    dists = {}
+    for dist in metadata.distributions():
+        name = dist.metadata['Name']
+        if not name:
+            continue
+        dists.setdefault(canonical(name), dist)
+    return dists
+
+
+def parse_requires(dist):
+    ''' Requirement objects for a distribution, skipping lines that do not parse '''
+    reqs = []
+    for line in dist.requires or []:
+        try:
+            reqs.append(Requirement(line))
+        except InvalidRequirement:
+            continue
+    return reqs
+
+
+def applies(req, extras):
+    ''' Whether a requirement's marker holds here for any of `extras` '''
+    if req.marker is None:
+        return True
+    for extra in extras or {''}:
+        try:
+            if req.marker.evaluate({'extra': extra}):
+                return True
+        except UndefinedEnvironmentName:
+            continue
+    return False
+
+
+def build_graph():
+    ''' {name: {'name', 'version', 'requires'}} for every installed package.
+
+    Markers are evaluated against the running interpreter. Optional
+    requirements (`extra == "..."`) count only when an installed package
+    actually asks for that extra. '''
+    dists = installed()
+    reqs = {key: parse_requires(dist) for key, dist in dists.items()}
+
+    # extras requested from each package by the rest of the environment
+    wanted = {key: {''} for key in dists}
+    for key, items in reqs.items():
+        for req in items:
+            dep = canonical(req.name)
+            if dep in wanted and req.extras and applies(req, {''}):
+                wanted[dep].update(req.extras)
+
+    graph = {}
+    for key, dist in dists.items():
+        requires = []
+        for req in reqs[key]:
+            dep = canonical(req.name)
+            if dep != key and dep not in requires and applies(req, wanted[key]):
+                requires.append(dep)
+        graph[key] = {
+            'name': dist.metadata['Name'],
+            'version': dist.version,
+            'requires': requires,
+        }
+    return graph
+
+
+def load_graph(cache=True):
+    ''' build_graph(), reused from debug/cache while the environment is unchanged '''
+    path = os.path.join(CACHE_DIR, 'tree.json')
+    with ducktrace.span('fingerprint'):
+        key = fingerprint()
+    if cache:
+        try:
+            with ducktrace.span('read graph cache'):
+                with open(path, 'r') as f:
+                    cached = json.load(f)
+            if cached.get('fingerprint') == key:
+                return cached['graph']
+        except (OSError, ValueError):
+            pass
+
+    with ducktrace.span('build graph'):
+        graph = build_graph()
+    if cache:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump({'fingerprint': key, 'graph': graph}, f)
+        except OSError:
+            pass
+    return graph
+
+
+class Graph:
+    ''' Dependency graph with forward (requires) and reverse (required_by) indexes,
+    both built once from the {name: node} dict returned by load_graph() '''
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.requires = {key: list(node['requires']) for key, node in nodes.items()}
+        self.required_by = {key: [] for key in nodes}
+        for key, deps in self.requires.items():
+            for dep in deps:
+                self.required_by.setdefault(dep, []).append(key)
+
+    def __contains__(self, name):
+        return canonical(name) in self.nodes
+
+    def label(self, key):
+        node = self.nodes.get(key)
+        if not node:
+            return f'{key} (not installed)'
+        return f"{node['name']} @{node['version']}"
+
+    def roots(self, ignored=IGNORED):
+        ''' Packages nobody else requires, in install-name order '''
+        skip = {canonical(x) for x in ignored}
+        return sorted(key for key in self.nodes
+                      if not self.required_by.get(key) and key not in skip)
+
+    def ancestors(self, name):
+        ''' Every package that depends on `name`, directly or not '''
+        target = canonical(name)
+        seen, stack = set(), [target]
+        while stack:
+            for parent in self.required_by.get(stack.pop(), []):
+                if parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
+        seen.discard(target)
+        return seen
+
+    def paths(self, name, sources, limit=1000):
+        ''' Every path from one of `sources` down to `name`, at most `limit` of them.
+        The walk only enters packages that can reach `name`, so unrelated
+        parts of the environment are never visited. '''
+        target = canonical(name)
+        reach = self.ancestors(target) | {target}
+        found = []
+
+        def walk(key, path):
+            if len(found) >= limit:
+                return
+            if key == target:
+                found.append(path)
+                return
+            for dep in self.requires.get(key, []):
+                if dep in reach and dep not in path:
+                    walk(dep, path + [dep])
+
+        for source in sources:
+            key = canonical(source)
+            if key in reach:
+                walk(key, [key])
+        return found
+
+    def to_json(self):
+        return {
+            key: dict(node, required_by=sorted(self.required_by.get(key, [])))
+            for key, node in self.nodes.items()
+        }
+
+
+def requirement_name(spec):
+    ''' `requests>=2.0` -> `requests`, as written in duck.toml dependencies '''
+    try:
+        return canonical(Requirement(spec).name)
+    except InvalidRequirement:
+        return canonical(re.split(r'[<>=!~ \[;@]', spec.strip(), 1)[0])
+
+
+def pinned(line):
+    ''' (name, version) for a `name==version` lockfile line; version is None
+    for anything else pip understands (urls, ranges), name is None for lines
+    that are not requirements at all (editables, options) '''
+    line = line.split(' #', 1)[0].strip()
+    if not line or line.startswith('#'):
+        return None, None
+    if line.startswith('-'):
+        return None, None
+    try:
+        req = Requirement(line)
+    except InvalidRequirement:
+        return None, None
+    specs = list(req.specifier)
+    if req.url is None and len(specs) == 1 and specs[0].operator in ('==', '==='):
+        return canonical(req.name), specs[0].version
+    return canonical(req.name), None
+
+
+def delta(lines, dists=None):
+    ''' Split lockfile lines into what must be installed and what already is.
+
+    Returns (install, editable, unchanged, changes): requirement strings for
+    pip, the urls of `-e` lines that are not installed as written, and a map
+    of each package to (installed version or None, locked version or None,
+    locked line). The line is what to show for specs that are not plain pins
+    (urls, ranges). '''
+    dists = installed() if dists is None else dists
+    install, editable, unchanged, changes = [], [], [], {}
+    frozen = None
+    for line in lines:
+        name, version = pinned(line)
+        if name is None:
+            spec = line.split(' #', 1)[0].strip()
+            if spec.startswith('-e'):
+                url = spec[2:].strip()
+                if frozen is None:
+                    frozen = {freeze_line(dist) for dist in dists.values()}
+                if f'-e {url}' in frozen:
+                    unchanged.append(line)
+                else:
+                    editable.append(url)
+            continue
+        dist = dists.get(name)
+        current = dist.version if dist else None
+        if dist and version is None:
+            # not a plain pin, trust whatever is already installed
+            unchanged.append(line)
+            continue
+        if dist and version is not None:
+            try:
+                same = Version(current) == Version(version)
+            except InvalidVersion:
+                same = current == version
+            if same:
+                unchanged.append(line)
+                continue
+        spec = line.split(' #', 1)[0].strip()
+        install.append(spec)
+        changes[name] = (current, version, spec)
+    return install, editable, unchanged, changes
+
+
+FREEZE_SKIP = ['pip', 'setuptools', 'wheel', 'distribute']
+
+
+def record_digest(dist):
+    ''' sha256 over every `path,sha256=...` entry in a distribution's RECORD.
+    Two installs of a version only share it when they came from the same
+    build, so a rebuilt or tampered wheel shows up as a new digest. '''
+    digest = hashlib.sha256()
+    entries = sorted(f'{f.as_posix()},{f.hash.mode}={f.hash.value}'
+                     for f in dist.files or [] if f.hash)
+    if not entries:
+        return None
+    for entry in entries:
+        digest.update(entry.encode() + b'\n')
+    return digest.hexdigest()
+
+
+def locked_digest(line):
+    ''' The `# sha256:` digest freeze() put on a lockfile line, or None '''
+    found = re.search(r'#\s*sha256:([0-9a-f]{64})', line)
+    return found.group(1) if found else None
+
+
+def mismatched(lines, dists=None):
+    ''' [(name, locked digest, installed digest)] for lockfile lines whose
+    installed distribution has a different RECORD than the one locked '''
+    dists = installed() if dists is None else dists
+    found = []
+    for line in lines:
+        locked = locked_digest(line)
+        name = pinned(line)[0]
+        if locked is None or name not in dists:
+            continue
+        current = record_digest(dists[name])
+        if current is not None and current != locked:
+            found.append((name, locked, current))
+    return found
+
+
+def freeze_line(dist):
+    ''' What `pip freeze` prints for a distribution '''
+    name = dist.metadata['Name']
+    try:
+        direct = json.loads(dist.read_text('direct_url.json') or 'null')
+    except ValueError:
+        direct = None
+    if not direct or 'url' not in direct:
+        return f'{name}=={dist.version}'
+    url = direct['url']
+    if 'vcs_info' in direct:
+        vcs = direct['vcs_info']
+        url = f"{vcs['vcs']}+{url}@{vcs.get('commit_id', '')}".rstrip('@')
+    if direct.get('dir_info', {}).get('editable'):
+        return f'-e {url}'
+    return f'{name} @ {url}'
+
+
+def freeze(dists=None):
+    ''' Lockfile text for the active environment, one pin per line with the
+    RECORD digest as a trailing comment pip ignores (inherit checks it,
+    see mismatched()) '''
+    dists = installed() if dists is None else dists
+    lines = []
+    for key in sorted(dists):
+        if key in FREEZE_SKIP:
+            continue
+        dist = dists[key]
+        line = freeze_line(dist)
+        digest = record_digest(dist)
+        if digest and not line.startswith('-e'):
+            line += f'  # sha256:{digest}'
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def lock(path='freeze.txt', force=False):
+    ''' Write the lockfile unless the environment is unchanged since the last
+    lock. Returns True when the file was (re)written. '''
+    state_path = os.path.join(CACHE_DIR, 'lock.json')
+    with ducktrace.span('fingerprint'):
+        key = fingerprint()
+    try:
+        with open(path, 'rb') as f:
+            current = f.read()
+    except OSError:
+        current = None
+
+    if not force and current is not None:
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            if (state.get('fingerprint') == key
+                    and state.get('sha256') == hashlib.sha256(current).hexdigest()):
+                return False
+        except (OSError, ValueError):
+            pass
+
+    with ducktrace.span('freeze'):
+        text = freeze().encode()
+    written = text != current
+    if written:
+        with open(path, 'wb') as f:
+            f.write(text)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(state_path, 'w') as f:
+            json.dump({'fingerprint': key, 'sha256': hashlib.sha256(text).hexdigest()}, f)
+    except OSError:
+        pass
+    return written
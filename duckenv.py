@@ -0,0 +1,211 @@
+''' Whole-environment operations: cloning a venv for `duck init`, and the
+snapshots behind `duck upgrade` and `duck rollback`.
+
+Both link every file of a tree into a new location (reflink, hardlink or
+copy, as duckstore.place() manages) from a pool of threads, so even a large
+environment costs one metadata operation per file instead of a full read
+and write. pip never edits an installed file in place, it removes and
+writes new ones, so a linked snapshot keeps the old contents after an
+upgrade.
+
+In a clone, the few files that embed the venv's own absolute path
+(pyvenv.cfg, bin/ scripts and activate files, .pth and .egg-link files) are
+written out rewritten instead, so the clone does not lean on the original. '''
+
+import concurrent.futures
+import json
+import os
+import shutil
+import sys
+import sysconfig
+import time
+
+import duckstore
+
+SNAPSHOT_DIR = 'debug/snapshots'
+KEEP = 5
+
+
+def _rewritable(rel):
+    first = rel.split(os.sep)[0]
+    return rel == 'pyvenv.cfg' or first in ('bin', 'Scripts') or rel.endswith(('.pth', '.egg-link'))
+
+
+def _files(src):
+    ''' ([regular files], [symlinks]) under `src`, relative to it '''
+    files, links = [], []
+    for parent, dirs, names in os.walk(src):
+        rel = os.path.relpath(parent, src)
+        for name in dirs + names:
+            path = os.path.join(parent, name)
+            target = os.path.normpath(os.path.join(rel, name))
+            if os.path.islink(path):
+                links.append(target)
+            elif name in names:
+                files.append(target)
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(parent, d))]
+    return files, links
+
+
+def link_tree(src, dst, jobs=None, rewrite=()):
+    ''' Recreate the tree at `src` under `dst`, linking files where possible.
+    Occurrences of the `rewrite` prefixes in rewritable files and absolute
+    symlinks become `dst`. Returns (files, bytes, {method: files}). '''
+    src, dst = os.path.abspath(src), os.path.abspath(dst)
+    old = sorted(rewrite, key=len, reverse=True)
+    files, links = _files(src)
+
+    for parent, dirs, _ in os.walk(src):
+        os.makedirs(os.path.join(dst, os.path.relpath(parent, src)), exist_ok=True)
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(parent, d))]
+    for rel in links:
+        target = os.readlink(os.path.join(src, rel))
+        for prefix in old:
+            if target == prefix or target.startswith(prefix + os.sep):
+                target = dst + target[len(prefix):]
+                break
+        os.symlink(target, os.path.join(dst, rel))
+
+    def copy(chunk):
+        used, size = {}, 0
+        for rel in chunk:
+            path, out = os.path.join(src, rel), os.path.join(dst, rel)
+            size += os.path.getsize(path)
+            method = None
+            if old and _rewritable(rel):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if any(prefix.encode() in data for prefix in old):
+                    for prefix in old:
+                        data = data.replace(prefix.encode(), dst.encode())
+                    with open(out, 'wb') as f:
+                        f.write(data)
+                    os.chmod(out, os.stat(path).st_mode & 0o7777)
+                    method = 'rewritten'
+            method = method or duckstore.place(path, out)
+            used[method] = used.get(method, 0) + 1
+        return used, size
+
+    jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+    chunks = [files[i::jobs * 8] for i in range(jobs * 8)]
+    used, size = {}, 0
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        for counts, n in pool.map(copy, chunks):
+            size += n
+            for method, count in counts.items():
+                used[method] = used.get(method, 0) + count
+    return len(files), size, used
+
+
+def clone(src, dst, jobs=None):
+    ''' Clone the venv at `src` into `dst`, which must not exist yet.
+    Returns (files, bytes, seconds, {method: files}). '''
+    start = time.perf_counter()
+    src = os.path.abspath(src)
+    files, size, used = link_tree(src, dst, jobs, rewrite={src, os.path.realpath(src)})
+    return files, size, time.perf_counter() - start, used
+
+
+# ------------------------------
+# snapshots
+
+def in_venv():
+    return sys.prefix != sys.base_prefix
+
+
+def _environment():
+    ''' {name in a snapshot: directory} for what an upgrade can change '''
+    if not in_venv():
+        # the system interpreter's bin/ and site-packages are not duck's to
+        # copy or swap out (see snapshot())
+        raise OSError("snapshots need a virtual environment, activate the project's (debug/ducky)")
+    paths = sysconfig.get_paths()
+    found = {'site-packages': paths['purelib']}
+    if paths['platlib'] != paths['purelib']:
+        found['platlib'] = paths['platlib']
+    found['bin'] = paths['scripts']
+    return found
+
+
+def snapshots(directory=SNAPSHOT_DIR):
+    ''' Metadata of every complete snapshot, oldest first '''
+    found = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return found
+    for name in names:
+        try:
+            with open(os.path.join(directory, name, 'snapshot.json'), 'r') as f:
+                found.append(dict(json.load(f), id=name, path=os.path.join(directory, name)))
+        except (OSError, ValueError):
+            continue
+    return found
+
+
+def snapshot(reason, lockfile='freeze.txt', keep=KEEP, directory=SNAPSHOT_DIR):
+    ''' Link the active environment and copy the lockfile into a new
+    snapshot, then drop the oldest beyond `keep`. Returns its metadata.
+    Raises OSError outside a virtual environment. '''
+    import duckdeps
+
+    environment = _environment()
+    start = time.perf_counter()
+    sid = time.strftime('%Y%m%d-%H%M%S')
+    taken = {s['id'] for s in snapshots(directory)}
+    n = 1
+    while sid in taken or os.path.exists(os.path.join(directory, sid)):
+        n += 1
+        sid = f"{time.strftime('%Y%m%d-%H%M%S')}-{n}"
+    path = os.path.join(directory, sid)
+
+    files = size = 0
+    for name, src in environment.items():
+        count, nbytes, _ = link_tree(src, os.path.join(path, name))
+        files, size = files + count, size + nbytes
+    if os.path.exists(lockfile):
+        shutil.copy2(lockfile, os.path.join(path, 'freeze.txt'))
+    meta = {
+        'reason': reason,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'packages': {key: dist.version for key, dist in duckdeps.installed().items()},
+        'lockfile': lockfile if os.path.exists(lockfile) else None,
+        'files': files,
+        'bytes': size,
+        'seconds': time.perf_counter() - start,
+    }
+    with open(os.path.join(path, 'snapshot.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    if keep > 0:
+        for old in snapshots(directory)[:-keep]:
+            shutil.rmtree(old['path'], ignore_errors=True)
+    return dict(meta, id=sid, path=path)
+
+
+def restore(snap):
+    ''' Put the environment and lockfile back as they were in `snap`. Each
+    directory is rebuilt next to the live one and swapped in with renames.
+    Raises OSError outside a virtual environment. '''
+    environment = _environment()
+    start = time.perf_counter()
+    for name, live in environment.items():
+        saved = os.path.join(snap['path'], name)
+        if not os.path.isdir(saved):
+            continue
+        fresh, stale = f'{live}.duck-restore', f'{live}.duck-stale'
+        for leftover in (fresh, stale):
+            shutil.rmtree(leftover, ignore_errors=True)
+        link_tree(saved, fresh)
+        os.rename(live, stale)
+        os.rename(fresh, live)
+        shutil.rmtree(stale, ignore_errors=True)
+    if snap.get('lockfile'):
+        shutil.copy2(os.path.join(snap['path'], 'freeze.txt'), snap['lockfile'])
+    return time.perf_counter() - start
+
+
+def changes(before, after):
+    ''' {package: (version before, version after)} for packages that differ '''
+    return {key: (before.get(key), after.get(key)) for key in sorted(before.keys() | after.keys())
+            if before.get(key) != after.get(key)}
@@ -1,4 +1,6 @@
 import ast, re
+import concurrent.futures, functools, hashlib, json, os, sys
+import ducktrace
 
 def parse_function_args(args):
     parsed_args = []
@@ -87,80 +89,98 @@ def parse_module(file_content):
 # ----------------------------------------------------
 # All parsing is done. Now generating html.
 
-def dilute_desc(doc):
-	''' Handle code, error, example- blocks, hyperlinks, bold-text
-	Every text is rendered here first.'''
-
-	doc = doc.replace('\n', '<br>').replace('\t', '&nbsp;&nbsp;&nbsp;&nbsp;').replace(' ', '&nbsp;')
-	doc = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2"> \1 </a>', doc)
-
-	blocks = r'''
+_BLOCK = r'''
 		<div class="[X]block">
 			<p id="[X]block-h"> [X] </p>
-			<code id="[X]block-main" style="font-size: 14px;"> \1 </code>
+			<code id="[X]block-main" style="font-size: 14px;"> [BODY] </code>
 		</div>
 	'''
-
-	doc = re.sub(r'`code(.*)`', str(blocks.replace('[X]', 'code')), doc)
-	doc = re.sub(r'`error(.*)`', str(blocks.replace('[X]', 'error')), doc)
-	doc = re.sub(r'`example(.*)`', str(blocks.replace('[X]', 'example')), doc)
-	doc = re.sub(r'\*\*(.*)\*\*', r'<b> \1 </b>', doc)
-	return doc
-
-def dilute_fn(functions):
-	''' Handles all functions at once '''
-	func_html = '<h1> Functions </h1>'
-	overview_fn = ''
-
-	for name, others in functions.items():
-		args = ''
-		for x in others['params']:
-			if not x[1]: args += f'{x[0]}, '
-			else: args += f'{x[0]}: {x[1]}, '
-		args = args[:-2]
-
-		overview_fn += rf'<li><a href="#{name}"> {name} </a></li>'
-		if others['return_type']:
-			func_html += rf'''
+_BLOCKS = {kind: _BLOCK.replace('[X]', kind).split('[BODY]') for kind in ('code', 'error', 'example')}
+
+# one alternation per markup element, tried left to right in a single scan
+_MARKUP = re.compile(r'''
+	\[(?P<text>.*?)\]\((?P<href>.*?)\)          # [text](href)
+	| `(?P<kind>code|error|example)(?P<body>.*?)`  # `code ...`, `error ...`, `example ...`
+	| \*\*(?P<bold>.+?)\*\*                       # **bold**
+''', re.S | re.X)
+
+def _markup(match):
+	kind = match.group('kind')
+	if kind:
+		head, tail = _BLOCKS[kind]
+		return head + _render(match.group('body')) + tail
+	bold = match.group('bold')
+	if bold is not None: return f'<b> {_render(bold)} </b>'
+	return f'<a href="{match.group("href")}"> {_render(match.group("text"))} </a>'
+
+def _render(doc):
+	return _MARKUP.sub(_markup, doc)
+
+@functools.lru_cache(maxsize=1 << 14)
+def dilute_desc(doc):
+	''' Handle code, error, example- blocks, hyperlinks, bold-text
+	Every text is rendered here first, in one pass; identical docstrings are rendered once.'''
+	# whitespace escaping stays on str.replace, it beats any per-character callback
+	doc = doc.replace('\n', '<br>').replace('\t', '&nbsp;&nbsp;&nbsp;&nbsp;').replace(' ', '&nbsp;')
+	return _render(doc)
+
+def render_fn(name, others):
+	''' One function: its summary entry and its block '''
+	args = ''
+	for x in others['params']:
+		if not x[1]: args += f'{x[0]}, '
+		else: args += f'{x[0]}: {x[1]}, '
+	args = args[:-2]
+
+	overview = rf'<li><a href="#{name}"> {name} </a></li>'
+	if others['return_type']:
+		html = rf'''
 				<div class="func-block" id="{name}">
 				    <h1 font-weight="bolder"> -> {name}: [{args}] -> {others['return_type']} </h1>
 				    <p id="func-desc"> {dilute_desc(others['docstring'])} </p>
 				</div>
 			'''
-		else:
-			func_html +=  rf'''
+	else:
+		html = rf'''
 				<div class="func-block" id="{name}">
 				    <h2 font-weight="bolder"> -> {name}: [{args}] </h2>
 				    <p> {dilute_desc(others['docstring'])} </p>
 				</div>
 			'''
-	return func_html, overview_fn
+	return overview, html
 
+def dilute_fn(functions):
+	''' Handles all functions at once '''
+	func_html = '<h1> Functions </h1>'
+	overview_fn = ''
 
-def dilute_cls(classes):
-	''' Handles all classes at once '''
-	cls_html = '<h1> Classes </h1>'
-	overview_cls = ''
+	for name, others in functions.items():
+		overview, html = render_fn(name, others)
+		overview_fn += overview
+		func_html += html
+	return func_html, overview_fn
 
-	for name, others in classes.items():
-		overview_cls += rf'<li><a href="#{name}"> {name} </a></li>'
-		cls_html += rf'''
+
+def render_cls(name, others):
+	''' One class with its methods: its summary entry and its blocks '''
+	overview = rf'<li><a href="#{name}"> {name} </a></li>'
+	cls_html = rf'''
 			<div class="class-block" id="{name}">
 				<h1> -> {name} </h1>
 				<p> {dilute_desc(others['docstring'])} </p>
 			</div>
 		'''
 
-		cls_html += f'<h2 class="cls-func-block"> Functions: {name} </h2>'
-		for fname, other in others['methods'].items():
-			args = ''
-			for x in other['params']:
-				if not x[1]: args += f'{x[0]}, '
-				else: args += f'{x[0]}:  {x[1]}, '
-			args = args[:-2]
+	cls_html += f'<h2 class="cls-func-block"> Functions: {name} </h2>'
+	for fname, other in others['methods'].items():
+		args = ''
+		for x in other['params']:
+			if not x[1]: args += f'{x[0]}, '
+			else: args += f'{x[0]}:  {x[1]}, '
+		args = args[:-2]
 
-			if not other['return_type']:
-				cls_html +=  rf'''
+		if not other['return_type']:
+			cls_html +=  rf'''
 					<div class="cls-func-block" id="{fname}">
 						<div id="cls-func-block-h">
 						<h2 font-weight="bolder"> {fname}: [{args}] </h2>
@@ -168,8 +188,8 @@ def dilute_cls(classes):
 						</div>
 					</div>
 				'''
-			else:
-				cls_html +=  rf'''
+		else:
+			cls_html +=  rf'''
 					<div class="cls-func-block" id="{fname}">
 						<div id="cls-func-block-h">
 						<h2 font-weight="bolder"> {fname}: [{args}] -> {other['return_type']}  </h2>
@@ -177,6 +197,17 @@ def dilute_cls(classes):
 						</div>
 					</div>
 				'''
+	return overview, cls_html
+
+def dilute_cls(classes):
+	''' Handles all classes at once '''
+	cls_html = '<h1> Classes </h1>'
+	overview_cls = ''
+
+	for name, others in classes.items():
+		overview, html = render_cls(name, others)
+		overview_cls += overview
+		cls_html += html
 	return cls_html, overview_cls
 
 def dilute_header(toplevel):
@@ -195,30 +226,33 @@ base_html = r'''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>duck</title>
-    <link rel="icon" href="logo.svg" type="image/x-icon">
+    <link rel="icon" href="[ICON]" type="image/x-icon">
+    [STYLE]
 
 </head>
 <body>
     <div class="head">
-        <img src="duck.jpg" class="logo" alt="duck duck" title="duck duck"></img>
+        <img src="[LOGO]" class="logo" alt="duck duck" title="duck duck"></img>
         <h1>duck: A Python Professional's Toolchain</h1>
     </div>
     <p id="head-end">Documentation generated by duck</p>
+    <div class="search">
+        <input id="search" type="search" placeholder="Search functions, classes, docs" autocomplete="off">
+        <ol id="search-results"></ol>
+    </div>
     <hr>
 
     [HEADER]
     [FUNCTION]
     [CLASS]
 
+    [SCRIPT]
 </body>
+</html>
+'''
 
-<style>
-    @font-face {
-      font-family: "Iosevka";
-      src: url("fonts/Iosevka1.ttf") format("truetype");
-      font-weight: normal;
-      font-style: normal;
-    }
+base_css = r'''
+    [FONT]
     html {
         font-family: 'Iosevka';
     }
@@ -318,32 +352,185 @@ base_html = r'''
         justify-content: space-between;
         width: 50%;
     }
-</style>
-</html>
-'''
 
+    .search {
+        margin-left: 4%;
 
+        #search {
+            font-family: 'Iosevka';
+            width: 40%;
+            padding: 5px;
+        }
+    }
+'''
 
+search_js = r'''
+    (function () {
+        var box = document.getElementById('search'), out = document.getElementById('search-results');
+        function first(tokens, prefix) {
+            var lo = 0, hi = tokens.length;
+            while (lo < hi) {
+                var mid = (lo + hi) >> 1;
+                if (tokens[mid][0] < prefix) lo = mid + 1; else hi = mid;
+            }
+            return lo;
+        }
+        function search(index, words, limit) {
+            // ids whose tokens start with every word, exact token matches first
+            var tokens = index.tokens, seen = new Uint8Array(index.symbols.length), hits = [];
+            words = words.slice(0, 255);
+            for (var w = 0; w < words.length; w++) {
+                var last = w === words.length - 1;
+                hits = [];
+                for (var i = first(tokens, words[w]); i < tokens.length && tokens[i][0].startsWith(words[w]); i++) {
+                    for (var list = tokens[i][1], id = 0, j = 0; j < list.length; j++) {
+                        id += list[j];
+                        if (seen[id] === w) {
+                            seen[id] = w + 1; hits.push(id);
+                            if (last && hits.length >= limit) return hits;
+                        }
+                    }
+                }
+                if (!hits.length) break;
+            }
+            return hits.slice(0, limit);
+        }
+        box.addEventListener('input', function () {
+            var index = window.DUCK_SEARCH, words = box.value.toLowerCase().match(/[a-z0-9]+/g) || [];
+            out.innerHTML = '';
+            if (!index || !words.length) return;
+            search(index, words, 50).forEach(function (id) {
+                var s = index.symbols[id], li = document.createElement('li'), a = document.createElement('a');
+                a.href = index.pages[s[0]] + '#' + s[2]; a.textContent = s[3]; a.title = s[1];
+                li.appendChild(a); out.appendChild(li);
+            });
+        });
+    })();
+'''
 
-# ------------------------------
-# now take in file and spit html back at ya'
-import argparse
-parser = argparse.ArgumentParser(description="What file do you want doc for?")
-parser.add_argument("--code", help="source code?", default="file.py")
-parser.add_argument("--output", help="output filename?", default="debug/html/index.html")
-args = parser.parse_args()
-
-
-
-with open(args.output, 'w') as f:
-  res = parse_module(args.code)
-  header, cls_html, fn_html, summary_cls, summary_fn = '', '', '', '', ''
-  if res['toplvl']: header = dilute_header(res['toplvl'])
-  if res['classes']: cls_html, summary_cls = dilute_cls(res['classes'])
-  if res['functions']: fn_html, summary_fn = dilute_fn(res['functions'])
 
-  header = rf'''
-	{header}
+# ------------------------------
+# Per-file cache: every source file is parsed and rendered once, then reused
+# from debug/cache/doc until its content (or ducker itself) changes.
+
+__version__ = '0.2.0'
+CACHE_DIR = 'debug/cache/doc'
+
+with open(__file__, 'rb') as _self:
+	_SELF_DIGEST = hashlib.sha256(_self.read()).hexdigest()
+
+
+def render_module(module):
+	''' Pre-render every class and function of a parsed module '''
+	return {
+		'toplvl': dilute_header(module['toplvl']) if module['toplvl'] else '',
+		'functions': {name: render_fn(name, others) for name, others in module['functions'].items()},
+		'classes': {name: render_cls(name, others) for name, others in module['classes'].items()},
+	}
+
+
+def load_module(path, cache_dir=CACHE_DIR, memo=None):
+	''' Parsed module and rendered fragments of one file, from cache when the
+	file content and ducker version are unchanged. A long-running caller can
+	pass a `memo` dict to skip even reading files whose mtime and size match. '''
+	if memo is not None:
+		stat = os.stat(path)
+		stamp = (stat.st_mtime_ns, stat.st_size)
+		if path in memo and memo[path][0] == stamp:
+			return memo[path][1]
+		memo[path] = (stamp, load_module(path, cache_dir))
+		return memo[path][1]
+
+	with open(path, 'rb') as f:
+		content = f.read()
+	key = hashlib.sha256(f'{__version__}:{_SELF_DIGEST}:'.encode() + content).hexdigest()
+	entry = None
+	if cache_dir:
+		entry = os.path.join(cache_dir, hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:32] + '.json')
+		try:
+			with open(entry, 'r') as f:
+				cached = json.load(f)
+			if cached['key'] == key:
+				return cached['module'], cached['fragments']
+		except (OSError, ValueError, KeyError):
+			pass
+
+	module = parse_module(content.decode())
+	fragments = render_module(module)
+	if entry:
+		try:
+			os.makedirs(cache_dir, exist_ok=True)
+			with open(entry, 'w') as f:
+				json.dump({'key': key, 'path': path, 'module': module, 'fragments': fragments}, f)
+		except OSError:
+			pass
+	return module, fragments
+
+
+def signature(name, info):
+	''' `name(a, b: int) -> str` for a parsed function or method '''
+	args = ', '.join(f'{x[0]}: {x[1]}' if x[1] else x[0] for x in info['params'])
+	return f"{name}({args})" + (f" -> {info['return_type']}" if info['return_type'] else '')
+
+
+def symbols(module):
+	''' (anchor, kind, signature, docstring) for everything a module documents '''
+	found = []
+	for name, info in module['functions'].items():
+		found.append((name, 'function', signature(name, info), info['docstring']))
+	for name, info in module['classes'].items():
+		found.append((name, 'class', f'class {name}', info['docstring']))
+		for mname, minfo in info['methods'].items():
+			found.append((mname, 'method', f'{name}.' + signature(mname, minfo), minfo['docstring']))
+	return found
+
+
+_STOPWORDS = {'the', 'an', 'and', 'or', 'of', 'to', 'in', 'is', 'it', 'for', 'on', 'be', 'if', 'by', 'as', 'at', 'this', 'that', 'with'}
+
+def tokens(text, stopwords=()):
+	''' Lowercase search tokens: whole words plus their snake_case and camelCase parts '''
+	found = set()
+	for word in re.findall(r'[A-Za-z0-9_]+', text or ''):
+		found.add(word.lower().replace('_', ''))
+		for part in re.findall(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+', word):
+			found.add(part.lower())
+	return {x for x in found if x and x not in stopwords}
+
+
+def write_search_index(path, entries):
+	''' Write the inverted index for the search box as a script that sets
+	`window.DUCK_SEARCH` (a script loads from file:// too, unlike fetch()).
+
+	`entries` are (page, anchor, kind, signature, docstring). Tokens come from
+	signatures and docstrings and are kept sorted, so the page finds every
+	token with a prefix by binary search. Posting lists are delta encoded. '''
+	pages, table, listed = {}, {}, []
+	for page, anchor, kind, sig, doc in entries:
+		ident = len(listed)
+		listed.append([pages.setdefault(page, len(pages)), kind, anchor, sig])
+		for token in tokens(sig) | tokens(doc, _STOPWORDS):
+			table.setdefault(token, []).append(ident)
+	for ids in table.values():
+		for i in range(len(ids) - 1, 0, -1): ids[i] -= ids[i - 1]
+	index = {'pages': list(pages), 'symbols': listed, 'tokens': sorted(table.items())}
+	with open(path, 'w') as f:
+		f.write('window.DUCK_SEARCH=')
+		json.dump(index, f, separators=(',', ':'))
+		f.write(';\n')
+
+
+def merge(fragments):
+	''' Join per-file fragments in order. Later definitions replace earlier ones
+	with the same name, as if the files had been concatenated. '''
+	merged = {'toplvl': fragments[0]['toplvl'] if fragments else '', 'functions': {}, 'classes': {}}
+	for part in fragments:
+		merged['functions'].update(part['functions'])
+		merged['classes'].update(part['classes'])
+	return merged
+
+
+summary_html = r'''
+	[HEADER]
 		<div class="summary-wrapper">
 		<div class="summary">
 		    <div class="functions">
@@ -360,7 +547,356 @@ with open(args.output, 'w') as f:
 		    </div>
 		</div>
 	</div>
-	'''.replace('[FUNCTION]', summary_fn).replace('[CLASS]', summary_cls)
+	'''
+
+modules_html = r'''
+	[HEADER]
+		<div class="summary-wrapper">
+		    <h2> Modules </h2>
+		    <ol>
+		    [MODULES]
+		    </ol>
+		</div>
+	'''
+
+
+def _pieces(template, *marks):
+	''' Split a template at its [MARKS], so it can be written out piece by piece '''
+	pieces = []
+	for mark in marks:
+		head, template = template.split(mark, 1)
+		pieces.append(head)
+	return pieces + [template]
+
+_PAGE = _pieces(base_html, '[ICON]', '[STYLE]', '[LOGO]', '[HEADER]', '[FUNCTION]', '[CLASS]', '[SCRIPT]')
+_SUMMARY = _pieces(summary_html, '[HEADER]', '[FUNCTION]', '[CLASS]')
+_MODULES = _pieces(modules_html, '[HEADER]', '[MODULES]')
+
 
-  html = base_html.replace('[HEADER]', header).replace('[FUNCTION]', fn_html).replace('[CLASS]', cls_html)
-  f.write(html)
+# ------------------------------
+# Static assets: the stylesheet, the search script, the font and the images
+# are written once per site under content-hashed names (duck.<hash>.css, ...)
+# so a browser or any static host can cache them forever, and every page only
+# links to them. With fontTools installed the font is cut down to the
+# characters the pages actually use.
+
+FONT = 'Iosevka1.ttf'
+HASHED = re.compile(r'^[\w-]+\.[0-9a-f]{10}\.\w+$')
+_HERE = os.path.dirname(os.path.abspath(__file__))
+# always in the font, so everyday edits do not produce a new subset
+_BASE_CHARS = {chr(c) for c in range(0x20, 0x7f)}
+
+_FONT_FACE = ('@font-face{font-family:"Iosevka";src:local("Iosevka"),url("[URL]") format("[FORMAT]");'
+	'font-weight:normal;font-style:normal;font-display:swap}')
+
+# the page as it was before the asset pipeline, for --code and other one-off pages
+INLINE = {
+	'icon': 'logo.svg',
+	'logo': 'duck.jpg',
+	'style': '<style>' + base_css.replace('[FONT]', _FONT_FACE.replace('[URL]', f'fonts/{FONT}').replace('[FORMAT]', 'truetype')) + '</style>',
+	'script': '<script src="search-index.js"></script>\n    <script>' + search_js + '</script>',
+}
+
+
+def minify_css(css):
+	css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+	css = re.sub(r'\s+', ' ', css)
+	css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+	css = re.sub(r':\s+', ':', css)
+	return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+	''' Indentation, blank lines and whole-line comments out; the script keeps its newlines '''
+	lines = (line.strip() for line in js.splitlines())
+	return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def hashed_name(name, data):
+	stem, ext = os.path.splitext(name)
+	return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+
+def _source(folder, name, output_dir):
+	''' An asset shipped with duck: next to ducker, in the install dir above it,
+	or where duck-hatch used to copy it into the site '''
+	for base in (_HERE, os.path.dirname(_HERE), output_dir):
+		for path in (os.path.join(base, folder, name), os.path.join(base, name)):
+			if os.path.isfile(path):
+				return path
+	return None
+
+
+def _font_format():
+	''' woff2 needs brotli next to fontTools, woff only zlib '''
+	import importlib.util
+	if importlib.util.find_spec('fontTools') is None:
+		return None
+	return 'woff2' if importlib.util.find_spec('brotli') or importlib.util.find_spec('brotlicffi') else 'woff'
+
+
+def subset_font(path, chars, cache_dir=CACHE_DIR):
+	''' (font bytes, extension) for the font cut down to `chars`. Without
+	fontTools the font is returned as it is. Subsets are cached by font and
+	character set, since subsetting takes a good part of a second. '''
+	with open(path, 'rb') as f:
+		data = f.read()
+	flavor = _font_format()
+	if flavor is None:
+		return data, os.path.splitext(path)[1]
+
+	text = ''.join(sorted(set(chars) | _BASE_CHARS))
+	key = hashlib.sha256(hashlib.sha256(data).digest() + f'{flavor}:{text}'.encode()).hexdigest()
+	cached = os.path.join(cache_dir, f'font-{key[:32]}.{flavor}') if cache_dir else None
+	if cached and os.path.exists(cached):
+		with open(cached, 'rb') as f:
+			return f.read(), f'.{flavor}'
+
+	import io
+	from fontTools import subset
+	options = subset.Options()
+	options.flavor = flavor
+	options.layout_features = ['*']
+	font = subset.load_font(io.BytesIO(data), options)
+	subsetter = subset.Subsetter(options)
+	subsetter.populate(text=text)
+	subsetter.subset(font)
+	out = io.BytesIO()
+	subset.save_font(font, out, options)
+	if cached:
+		os.makedirs(cache_dir, exist_ok=True)
+		with open(cached, 'wb') as f: f.write(out.getvalue())
+	return out.getvalue(), f'.{flavor}'
+
+
+def write_assets(output_dir, chars=(), cache_dir=CACHE_DIR):
+	''' Write the hashed assets of a site and return the markup pages use for
+	them, as INLINE, plus `files`: every asset name written '''
+	files = []
+
+	def emit(name, data):
+		out = hashed_name(name, data)
+		target = os.path.join(output_dir, out)
+		if not os.path.exists(target):
+			with open(target + '.tmp', 'wb') as f: f.write(data)
+			os.replace(target + '.tmp', target)
+		files.append(out)
+		return out
+
+	def copy(folder, name, fallback):
+		path = _source(folder, name, output_dir)
+		if not path: return fallback
+		with open(path, 'rb') as f:
+			return emit(name, f.read())
+
+	face = ''
+	font = _source('fonts', FONT, output_dir)
+	if font:
+		data, ext = subset_font(font, chars, cache_dir)
+		url = emit(f'iosevka{ext}', data)
+		face = _FONT_FACE.replace('[URL]', url).replace('[FORMAT]', {'.woff2': 'woff2', '.woff': 'woff'}.get(ext, 'truetype'))
+	css = emit('duck.css', minify_css(base_css.replace('[FONT]', face)).encode())
+	js = emit('duck.js', minify_js(search_js).encode())
+	return {
+		'icon': copy('images', 'logo.svg', 'logo.svg'),
+		'logo': copy('images', 'duck.jpg', 'duck.jpg'),
+		'style': f'<link rel="stylesheet" href="{css}">',
+		'script': f'<script src="search-index.js"></script>\n    <script src="{js}"></script>',
+		'files': files,
+	}
+
+
+def page_chars(fragments, chars):
+	''' Add every character of a module's rendered fragments to `chars` '''
+	chars.update(fragments['toplvl'])
+	for group in ('functions', 'classes'):
+		for overview, html in fragments[group].values():
+			chars.update(overview)
+			chars.update(html)
+
+
+def relink(path, old, new):
+	''' Point a written page at a new set of assets '''
+	with open(path, 'r') as f:
+		text = f.read()
+	for key in ('style', 'script'):
+		text = text.replace(old[key], new[key])
+	for key in ('icon', 'logo'):
+		text = text.replace(f'"{old[key]}"', f'"{new[key]}"')
+	with open(path, 'w') as f:
+		f.write(text)
+
+
+def _head(f, assets):
+	f.write(_PAGE[0]); f.write(assets['icon'])
+	f.write(_PAGE[1]); f.write(assets['style'])
+	f.write(_PAGE[2]); f.write(assets['logo'])
+	f.write(_PAGE[3])
+
+
+def write_page(f, toplvl, functions, classes, assets=INLINE):
+	''' Stream one page to an open file. `functions` and `classes` are lists
+	of (summary entry, block) pairs, written one at a time. '''
+	_head(f, assets)
+	f.write(_SUMMARY[0]); f.write(toplvl); f.write(_SUMMARY[1])
+	for overview, _ in functions: f.write(overview)
+	f.write(_SUMMARY[2])
+	for overview, _ in classes: f.write(overview)
+	f.write(_SUMMARY[3])
+
+	f.write(_PAGE[4])
+	if functions:
+		f.write('<h1> Functions </h1>')
+		for _, html in functions: f.write(html)
+	f.write(_PAGE[5])
+	if classes:
+		f.write('<h1> Classes </h1>')
+		for _, html in classes: f.write(html)
+	f.write(_PAGE[6]); f.write(assets['script']); f.write(_PAGE[7])
+
+
+def write_index(f, toplvl, modules, assets=INLINE):
+	''' Stream the index of a sharded site: `modules` is a list of
+	(page, name, function count, class count) '''
+	_head(f, assets)
+	f.write(_MODULES[0]); f.write(toplvl); f.write(_MODULES[1])
+	for page, name, n_fn, n_cls in modules:
+		f.write(rf'<li><a href="{page}"> {name} </a> ({n_fn} functions, {n_cls} classes)</li>')
+	f.write(_MODULES[2])
+	f.write(_PAGE[4]); f.write(_PAGE[5]); f.write(_PAGE[6]); f.write(assets['script']); f.write(_PAGE[7])
+
+
+def page_name(path):
+	''' `src/pkg/util.py` -> (`src.pkg.util.html`, `src.pkg.util`) '''
+	parts = [x for x in os.path.normpath(os.path.splitext(path)[0]).split(os.sep) if x not in ('', '.', '..')]
+	name = '.'.join(parts) or 'module'
+	page = f'{name}.html' if name != 'index' else 'index_.html'
+	return page, name
+
+
+def _load(job, memo=None):
+	''' load_module() for the process pool: errors come back as values '''
+	path, cache_dir = job
+	try:
+		with ducktrace.span(f'load {path}'):
+			module, fragments = load_module(path, cache_dir, memo)
+		return path, fragments, symbols(module), None
+	except (OSError, SyntaxError, UnicodeDecodeError) as exc:
+		return path, None, None, exc
+
+
+def build_docs(paths, output_dir='debug/html', cache=True, on_error=None, filename='index.html', jobs=1, sharded=False,
+		memo=None, changed=None):
+	''' Generate the documentation site for source files, in the order given.
+
+	`paths` may be any iterable (a generator is fine): files are read and
+	parsed one at a time, only their rendered fragments are kept. With
+	`jobs` > 1 files are parsed and rendered in a process pool; results are
+	still merged in the order of `paths`, so the output is the same as a
+	serial build. With `sharded`, every module gets its own page, written as
+	soon as it is rendered, and `filename` becomes a small index of them.
+	A search index of every symbol is written next to the pages, and so are
+	the content-hashed assets (see write_assets), listed in assets.json.
+	Files that can not be read or parsed are passed to `on_error(path, exc)`
+	and skipped. Returns the path of the written index page.
+
+	For repeated builds in one process (duck doc --watch) pass the same
+	`memo` dict every time and, when known, the set of `changed` paths:
+	sharded pages of other modules are then left as they are. '''
+	os.makedirs(output_dir, exist_ok=True)
+	output = os.path.join(output_dir, filename)
+	cache_dir = CACHE_DIR if cache else None
+	try:
+		with open(os.path.join(output_dir, 'assets.json'), 'r') as f:
+			previous = json.load(f)
+	except (OSError, ValueError):
+		previous = None
+	# sharded pages go out before every character is known, so they link the
+	# last build's assets and are relinked at the end only if those changed
+	assets = previous
+	if sharded and assets is None:
+		assets = write_assets(output_dir, (), cache_dir)
+	chars = set()
+
+	work = ((path, cache_dir) for path in paths)
+	pool = concurrent.futures.ProcessPoolExecutor(jobs) if jobs > 1 else None
+	with ducktrace.span('parse and render'):
+		try:
+			results = pool.map(_load, work, chunksize=8) if pool else (_load(job, memo) for job in work)
+			parts, modules, toplvl, search = [], [], None, {}
+			for path, fragments, found, exc in results:
+				if exc is not None:
+					if on_error: on_error(path, exc)
+					continue
+				page = page_name(path)[0] if sharded else filename
+				for anchor, kind, sig, doc in found:
+					# later definitions win, like they do on a single page. Keyed on
+					# the qualified name: methods of different classes share anchors
+					search[(page, kind, sig.split('(')[0])] = (page, anchor, kind, sig, doc)
+				if not sharded:
+					parts.append(fragments)
+					continue
+				page_chars(fragments, chars)
+				if toplvl is None: toplvl = fragments['toplvl']
+				page, name = page_name(path)
+				target = os.path.join(output_dir, page)
+				if changed is None or path in changed or not os.path.exists(target):
+					with open(target, 'w') as f:
+						write_page(f, f'<p><a href="{filename}"> &lt;- index </a></p>' + fragments['toplvl'],
+							list(fragments['functions'].values()), list(fragments['classes'].values()), assets)
+				modules.append((page, name, len(fragments['functions']), len(fragments['classes'])))
+		finally:
+			if pool: pool.shutdown()
+
+	with ducktrace.span('search index'):
+		write_search_index(os.path.join(output_dir, 'search-index.js'),
+			list(search.values()))
+	if sharded:
+		with ducktrace.span('assets'):
+			final = write_assets(output_dir, chars, cache_dir)
+		with ducktrace.span('relink pages'):
+			if any(final[key] != assets[key] for key in ('icon', 'logo', 'style', 'script')):
+				for page, _, _, _ in modules:
+					if os.path.exists(os.path.join(output_dir, page)):
+						relink(os.path.join(output_dir, page), assets, final)
+		with ducktrace.span('index page'), open(output, 'w') as f:
+			write_index(f, toplvl or '', modules, final)
+	else:
+		merged = merge(parts)
+		for part in parts: page_chars(part, chars)
+		with ducktrace.span('assets'):
+			final = write_assets(output_dir, chars, cache_dir)
+		with ducktrace.span('index page'), open(output, 'w') as f:
+			write_page(f, merged['toplvl'], list(merged['functions'].values()), list(merged['classes'].values()), final)
+
+	for name in set(assets['files'] if assets else ()) - set(final['files']):
+		if HASHED.match(name) and os.path.exists(os.path.join(output_dir, name)):
+			os.remove(os.path.join(output_dir, name))
+	with open(os.path.join(output_dir, 'assets.json'), 'w') as f:
+		json.dump(final, f, indent=1)
+	return output
+
+
+# ------------------------------
+# now take in file and spit html back at ya'
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description="What file do you want doc for?")
+	parser.add_argument("--code", help="source code?", default=None)
+	parser.add_argument("--files", help="source files, in order", nargs='*', default=[])
+	parser.add_argument("--output", help="output filename?", default="debug/html/index.html")
+	parser.add_argument("--no-cache", help="parse every file again", action='store_true')
+	parser.add_argument("--jobs", help="parse and render in N processes, 0 for one per core", type=int, default=1)
+	parser.add_argument("--sharded", help="one page per module plus an index", action='store_true')
+	args = parser.parse_args()
+
+	def skipped(path, exc):
+		print(f"Problems with including {path} in documentation. Skipping.", file=sys.stderr)
+
+	if args.code is not None:
+		module = render_module(parse_module(args.code))
+		with open(args.output, 'w') as f:
+			write_page(f, module['toplvl'], list(module['functions'].values()), list(module['classes'].values()))
+	else:
+		build_docs(args.files, os.path.dirname(args.output) or '.', not args.no_cache, skipped,
+			os.path.basename(args.output), args.jobs or os.cpu_count(), args.sharded)
@@ -0,0 +1,179 @@
+''' Persistent symbol index for `duck find`.
+
+Every module, class, method and function of the project, with its file,
+line, signature and docstring, is kept in a SQLite database under
+debug/cache. An update only stats the project's files: a file is parsed
+again only when its mtime or size moved and its content hash changed too,
+so a lookup on a large, unchanged codebase costs a directory walk and one
+indexed query. '''
+
+import ast
+import hashlib
+import os
+import sqlite3
+
+INDEX = 'debug/cache/symbols.sqlite3'
+SCHEMA = 2
+SKIP_DIRS = {'debug', '__pycache__', 'node_modules', 'build', 'dist'}
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, sha256 TEXT);
+CREATE TABLE IF NOT EXISTS symbols (
+    file TEXT, name TEXT, qualname TEXT, kind TEXT, line INTEGER, signature TEXT, doc TEXT);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols (file);
+'''
+
+
+def connect(path=INDEX):
+    ''' Open the index, recreating it when it was written by another schema '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.executescript(TABLES)
+    row = db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+    if row is None or row[0] != str(SCHEMA):
+        db.executescript('DROP TABLE symbols; DROP TABLE files; DROP TABLE meta;' + TABLES)
+        db.execute("INSERT INTO meta VALUES ('schema', ?)", (str(SCHEMA),))
+        db.commit()
+    return db
+
+
+def python_files(root):
+    ''' Project sources under `root`, leaving out debug/, hidden directories and venvs '''
+    for parent, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d not in SKIP_DIRS
+                         and not os.path.exists(os.path.join(parent, d, 'pyvenv.cfg')))
+        for name in sorted(files):
+            if name.endswith('.py'):
+                yield os.path.relpath(os.path.join(parent, name), root)
+
+
+def module_name(path):
+    parts = os.path.splitext(path)[0].split(os.sep)
+    if parts[-1] == '__init__' and len(parts) > 1:
+        parts = parts[:-1]
+    return '.'.join(parts)
+
+
+def signature(node):
+    if isinstance(node, ast.ClassDef):
+        bases = [ast.unparse(x) for x in node.bases] + [ast.unparse(x) for x in node.keywords]
+        return f"class {node.name}" + (f"({', '.join(bases)})" if bases else '')
+    prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+    returns = f' -> {ast.unparse(node.returns)}' if node.returns else ''
+    return f'{prefix} {node.name}({ast.unparse(node.args)}){returns}'
+
+
+def extract(path, source):
+    ''' (name, qualname, kind, line, signature, docstring) for the module and
+    everything defined in it, nested definitions included '''
+    tree = ast.parse(source)
+    module = module_name(path)
+    found = [(module.rpartition('.')[2], module, 'module', 1, module, ast.get_docstring(tree))]
+
+    def walk(body, scope, in_class):
+        for child in body:
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = f'{scope}.{child.name}'
+                if isinstance(child, ast.ClassDef):
+                    kind = 'class'
+                else:
+                    kind = 'method' if in_class else 'function'
+                found.append((child.name, qualname, kind, child.lineno, signature(child), ast.get_docstring(child)))
+                walk(child.body, qualname, isinstance(child, ast.ClassDef))
+                continue
+            # definitions under if/for/while/try/with/match blocks still
+            # belong to this scope; expressions never hold a def
+            for field in ('body', 'orelse', 'finalbody', 'handlers', 'cases'):
+                walk(getattr(child, field, ()), scope, in_class)
+    walk(tree.body, module, False)
+    return found
+
+
+def _extract(job):
+    ''' extract() for the process pool: parse errors come back as None '''
+    path, source = job
+    try:
+        return extract(path, source)
+    except (SyntaxError, ValueError):
+        return None
+
+
+def update(db, root='.', jobs=1):
+    ''' Bring the index up to date with the files under `root`, parsing changed
+    files in `jobs` processes when there are many of them.
+    Returns (files parsed again, files removed, files that failed to parse). '''
+    import concurrent.futures
+
+    known = {path: (mtime, size, sha) for path, mtime, size, sha in db.execute('SELECT * FROM files')}
+    stale, seen = [], set()
+    with db:
+        for path in python_files(root):
+            seen.add(path)
+            try:
+                stat = os.stat(os.path.join(root, path))
+            except OSError:
+                continue
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            old = known.get(path)
+            if old and old[:2] == stamp:
+                continue
+            with open(os.path.join(root, path), 'rb') as f:
+                source = f.read()
+            sha = hashlib.sha256(source).hexdigest()
+            db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, *stamp, sha))
+            if not old or old[2] != sha:
+                stale.append((path, source))
+
+        pool = concurrent.futures.ProcessPoolExecutor(jobs) if jobs > 1 and len(stale) > 32 else None
+        try:
+            results = pool.map(_extract, stale, chunksize=16) if pool else map(_extract, stale)
+            parsed, failed = [], []
+            for (path, _), rows in zip(stale, results):
+                db.execute('DELETE FROM symbols WHERE file = ?', (path,))
+                if rows is None:
+                    failed.append(path)
+                    continue
+                db.executemany('INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               [(path, *row) for row in rows])
+                parsed.append(path)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        removed = [path for path in known if path not in seen]
+        for path in removed:
+            db.execute('DELETE FROM symbols WHERE file = ?', (path,))
+            db.execute('DELETE FROM files WHERE path = ?', (path,))
+    return parsed, removed, failed
+
+
+def _like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def find(db, name, kind=None, limit=50):
+    ''' Symbols whose name starts with `name` (case-insensitive), exact
+    matches first. `Class.method` style names match against qualified names,
+    and when nothing starts with `name`, names containing it are returned. '''
+    scope, _, last = name.rpartition('.')
+    # a literal ESCAPE keeps the prefix LIKE on the name index
+    where, args = ["name LIKE ? ESCAPE '\\'"], [_like(last) + '%']
+    if scope:
+        where.append("(qualname LIKE ? ESCAPE '\\' OR qualname LIKE ? ESCAPE '\\')")
+        args += [_like(scope) + '.%', '%.' + _like(scope) + '.%']
+    if kind:
+        where.append('kind = ?')
+        args.append(kind)
+    query = ('SELECT file, line, kind, qualname, signature, doc FROM symbols WHERE {} '
+             'ORDER BY name = ? COLLATE NOCASE DESC, length(name), qualname, file LIMIT ?')
+    rows = db.execute(query.format(' AND '.join(where)), args + [last, limit]).fetchall()
+    if not rows:
+        args[0] = '%' + _like(last) + '%'
+        rows = db.execute(query.format(' AND '.join(where)), args + [last, limit]).fetchall()
+    return rows
+
+
+def counts(db):
+    return dict(db.execute('SELECT kind, count(*) FROM symbols GROUP BY kind'))
@@ -0,0 +1,345 @@
+''' Profiling for `duck run --profile`, `--sample`, `--memprofile` and `--import-time`.
+
+Deterministic profiles come from cProfile. The sampling profiler lives here:
+run as a script, it starts the target under a SIGPROF interval timer and
+records the main thread's stack on every tick, which gives real stacks for
+flame graphs (collapsed format, one `a;b;c count` line per stack). Ticks
+come at the kernel's timer resolution, not on the interval asked for, so
+the CPU time measured over the run goes to a .json sidecar and the sample
+counts are only taken as shares of it.
+
+The memory profiler runs the target under tracemalloc and takes snapshots
+every few seconds and whenever the process gets SIGUSR1, recording the top
+allocation sites, their growth since the previous snapshot and the resident
+set size over time into one JSON report. The report is rewritten after
+every snapshot, so a run the OOM killer ends still leaves the last one, and
+SIGTERM takes a final snapshot before the process dies.
+
+    python duckprof.py sample <output.collapsed> <interval> <script> [args]
+    python duckprof.py memory <output.json> <every> <script> [args] '''
+
+import json
+import os
+import re
+import sys
+import time
+
+PROFILE_DIR = 'debug/profile'
+
+
+def stamp():
+    return time.strftime('%Y%m%d-%H%M%S')
+
+
+def label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+# ------------------------------
+# sampling
+
+def sample(output, interval, script, args):
+    ''' Run `script` as __main__ and write the collapsed stacks it spent time in '''
+    import runpy
+    import signal
+
+    stacks = {}
+    # frames of the profiler and of runpy sit under every stack, leave them out
+    skip = {__file__, runpy.__file__, '<frozen runpy>'}
+
+    def tick(signum, frame):
+        names = []
+        while frame is not None:
+            if frame.f_code.co_filename not in skip:
+                names.append(label(frame.f_code))
+            frame = frame.f_back
+        if names:
+            key = ';'.join(reversed(names))
+            stacks[key] = stacks.get(key, 0) + 1
+
+    sys.argv = [script] + list(args)
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    signal.signal(signal.SIGPROF, tick)
+    cpu = time.process_time()
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        cpu = time.process_time() - cpu
+        with open(output, 'w') as f:
+            for key, count in sorted(stacks.items()):
+                f.write(f'{key} {count}\n')
+        with open(sidecar(output), 'w') as f:
+            json.dump({'cpu_seconds': cpu, 'samples': sum(stacks.values()), 'interval': interval}, f)
+
+
+def sidecar(path):
+    return os.path.splitext(path)[0] + '.sample.json'
+
+
+def cpu_seconds(path, stacks, interval):
+    ''' CPU time of a sampled run, from its sidecar. Older runs without one
+    fall back to one interval per sample. '''
+    try:
+        with open(sidecar(path), 'r') as f:
+            return json.load(f)['cpu_seconds']
+    except (OSError, ValueError, KeyError):
+        return sum(stacks.values()) * interval
+
+
+def read_collapsed(path):
+    stacks = {}
+    with open(path, 'r') as f:
+        for line in f:
+            key, _, count = line.rstrip('\n').rpartition(' ')
+            if key:
+                stacks[key] = stacks.get(key, 0) + int(count)
+    return stacks
+
+
+def sample_tables(stacks, seconds, top):
+    ''' (cumulative, self) rows of (seconds, share, function) from collapsed
+    stacks, each function's share of the samples taken of `seconds` '''
+    total = sum(stacks.values()) or 1
+    cumulative, own = {}, {}
+    for key, count in stacks.items():
+        frames = key.split(';')
+        own[frames[-1]] = own.get(frames[-1], 0) + count
+        for name in set(frames):
+            cumulative[name] = cumulative.get(name, 0) + count
+
+    def rows(counts):
+        best = sorted(counts.items(), key=lambda x: (-x[1], x[0]))[:top]
+        return [(seconds * count / total, count / total, name) for name, count in best]
+    return rows(cumulative), rows(own)
+
+
+# ------------------------------
+# memory
+
+MEMORY_TOP = 100
+RSS_INTERVAL = 0.1
+# [time, min, max] buckets kept of the RSS samples; two neighbours merge
+# whenever there are more, so an hour long run keeps as many as a short one
+RSS_POINTS = 512
+
+
+def rss():
+    ''' Resident set size of this process in bytes, None where /proc is missing '''
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _site(stat, root):
+    frame = stat.traceback[0]
+    path = frame.filename
+    if os.path.isabs(path) and path.startswith(root + os.sep):
+        path = os.path.relpath(path, root)
+    return f'{path}:{frame.lineno}'
+
+
+def _write_report(output, report):
+    ''' Replace `output` in one rename, a kill mid-write leaves the previous report '''
+    report['peak_rss'] = peak_rss()
+    with open(f'{output}.tmp', 'w') as f:
+        json.dump(report, f)
+    os.replace(f'{output}.tmp', output)
+
+
+def _add_rss(points, width, now, value):
+    ''' Fold one RSS sample into the [time, min, max] buckets, `width` is
+    a one-item list holding the bucket length in seconds '''
+    if points and now - points[-1][0] < width[0]:
+        points[-1][1] = min(points[-1][1], value)
+        points[-1][2] = max(points[-1][2], value)
+        return
+    points.append([round(now, 3), value, value])
+    if len(points) > RSS_POINTS:
+        points[:] = [[pair[0][0], min(x[1] for x in pair), max(x[2] for x in pair)]
+                     for pair in (points[i:i + 2] for i in range(0, len(points), 2))]
+        width[0] *= 2
+
+
+def memory(output, every, script, args, top=MEMORY_TOP):
+    ''' Run `script` as __main__ under tracemalloc and write the memory report.
+
+    A background thread samples RSS every RSS_INTERVAL seconds and takes a
+    snapshot every `every` seconds (never when 0) or when SIGUSR1 arrives;
+    one more is taken when the script ends or gets SIGTERM. Each snapshot
+    rewrites the report. '''
+    import runpy
+    import signal
+    import threading
+    import tracemalloc
+
+    root = os.getcwd()
+    # allocations made by the profiler and by runpy are not the script's. They
+    # are dropped from the grouped statistics by exact file name, which is far
+    # cheaper than Snapshot.filter_traces() matching patterns on every trace.
+    skip = {__file__, tracemalloc.__file__, threading.__file__, runpy.__file__, '<frozen runpy>', '<unknown>'}
+    report = {'script': script, 'args': list(args), 'pid': os.getpid(), 'every': every,
+              'snapshots': [], 'rss': []}
+    first, previous = [], []
+    width = [RSS_INTERVAL]
+    start = time.perf_counter()
+    wanted, done = threading.Event(), threading.Event()
+
+    def rows(stats, diff=False):
+        found = []
+        for stat in stats:
+            if stat.traceback[0].filename in skip or (diff and not stat.size_diff):
+                continue
+            found.append([_site(stat, root), stat.size_diff, stat.size, stat.count_diff] if diff
+                         else [_site(stat, root), stat.size, stat.count])
+            if len(found) == top:
+                break
+        return found
+
+    def take(reason):
+        snapshot = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        entry = {
+            'reason': reason,
+            'time': time.perf_counter() - start,
+            'traced': traced,
+            'traced_peak': peak,
+            'rss': rss(),
+            'sites': rows(snapshot.statistics('lineno')),
+        }
+        if previous:
+            entry['growth'] = rows(snapshot.compare_to(previous[0], 'lineno'), diff=True)
+        if first and reason in ('exit', 'terminate'):
+            entry['growth_total'] = rows(snapshot.compare_to(first[0], 'lineno'), diff=True)
+        first[:] = first or [snapshot]
+        previous[:] = [snapshot]
+        report['snapshots'].append(entry)
+        _write_report(output, report)
+
+    def watch():
+        due = every
+        while not done.wait(RSS_INTERVAL):
+            now = time.perf_counter() - start
+            value = rss()
+            if value is not None:
+                _add_rss(report['rss'], width, now, value)
+            if wanted.is_set():
+                wanted.clear()
+                take('signal')
+            elif every and now >= due:
+                take('interval')
+                due = now + every
+
+    sys.argv = [script] + list(args)
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    # the handler only flags the request, the snapshot is taken on the
+    # watcher thread so it never runs in the middle of the script's own frame
+    signal.signal(signal.SIGUSR1, lambda signum, frame: wanted.set())
+
+    def terminate(signum, frame):
+        # the last word before dying the way SIGTERM would have it
+        done.set()
+        thread.join()
+        take('terminate')
+        tracemalloc.stop()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+    tracemalloc.start()
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        done.set()
+        thread.join()
+        take('exit')
+        tracemalloc.stop()
+
+
+def read_memory(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def memory_diff(old, new, top):
+    ''' [(site, old bytes, new bytes)] between the final snapshots of two
+    reports, largest change first. Sites outside either report's top list
+    count as 0 there. '''
+    before = {site: size for site, size, _ in old['snapshots'][-1]['sites']}
+    after = {site: size for site, size, _ in new['snapshots'][-1]['sites']}
+    rows = [(site, before.get(site, 0), after.get(site, 0)) for site in before.keys() | after.keys()]
+    rows.sort(key=lambda x: (-abs(x[2] - x[1]), x[0]))
+    return [row for row in rows if row[1] != row[2]][:top]
+
+
+def latest_memory(directory, stem, exclude=None):
+    ''' The newest `<stem>-*.memory.json` report in `directory`, other than `exclude` '''
+    found = sorted(name for name in os.listdir(directory)
+                   if name.startswith(f'{stem}-') and name.endswith('.memory.json'))
+    found = [os.path.join(directory, name) for name in found]
+    found = [path for path in found if path != exclude]
+    return found[-1] if found else None
+
+
+def size(n):
+    sign = '-' if n < 0 else ''
+    n = abs(n)
+    for unit in ('B', 'KiB', 'MiB'):
+        if n < 1024:
+            return f'{sign}{n:.0f}{unit}' if unit == 'B' else f'{sign}{n:.1f}{unit}'
+        n /= 1024
+    return f'{sign}{n:.2f}GiB'
+
+
+# ------------------------------
+# cProfile
+
+def profile_tables(path, top):
+    ''' (cumulative, self) rows of (seconds, calls, function) from a cProfile dump '''
+    import pstats
+
+    stats = pstats.Stats(path).stats
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, callers) in stats.items():
+        where = f'{name} ({os.path.basename(filename)}:{line})' if line else name
+        rows.append((ct, tt, nc, where))
+    cumulative = [(ct, nc, where) for ct, tt, nc, where in sorted(rows, key=lambda x: -x[0])[:top]]
+    own = [(tt, nc, where) for ct, tt, nc, where in sorted(rows, key=lambda x: -x[1])[:top]]
+    return cumulative, own
+
+
+# ------------------------------
+# -X importtime
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$')
+
+
+def parse_importtime(text):
+    ''' ([(self us, cumulative us, depth, module)], other stderr lines) '''
+    rows, other = [], []
+    for line in text.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            rows.append((int(own), int(cumulative), (len(indent) - 1) // 2, module.strip()))
+        elif not line.startswith('import time:'):
+            other.append(line)
+    return rows, other
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5 or sys.argv[1] not in ('sample', 'memory'):
+        sys.exit(__doc__)
+    (sample if sys.argv[1] == 'sample' else memory)(sys.argv[2], float(sys.argv[3]), sys.argv[4], sys.argv[5:])
@@ -0,0 +1,211 @@
+''' Live documentation for `duck doc --watch` and `duck doc --duck`.
+
+A small HTTP server for debug/html that injects a reload script into every
+page and pushes reload events over server-sent events, plus a file watcher
+built on inotify (through ctypes, no extra packages) that falls back to
+polling where inotify is not available. '''
+
+import ctypes
+import ctypes.util
+import http.server
+import os
+import re
+import select
+import struct
+import threading
+import time
+
+EVENTS = '/__duck/events'
+# ducker's content-hashed assets never change under the same name
+IMMUTABLE = re.compile(r'^/[\w-]+\.[0-9a-f]{10}\.\w+$')
+RELOAD_SCRIPT = (f'<script>new EventSource("{EVENTS}").onmessage = '
+                 'function () { location.reload(); };</script>').encode()
+
+
+class Reloader:
+    ''' Generation counter the event stream of every open page waits on '''
+
+    def __init__(self):
+        self.generation = 0
+        self.cond = threading.Condition()
+
+    def notify(self):
+        with self.cond:
+            self.generation += 1
+            self.cond.notify_all()
+
+    def wait(self, seen, timeout=15):
+        with self.cond:
+            self.cond.wait_for(lambda: self.generation != seen, timeout)
+            return self.generation
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    reloader = None
+
+    def do_GET(self):
+        if self.path == EVENTS:
+            return self.events()
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if not path.endswith('.html') or not os.path.isfile(path):
+            return super().do_GET()
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        head, sep, tail = body.rpartition(b'</body>')
+        body = head + RELOAD_SCRIPT + sep + tail if sep else body + RELOAD_SCRIPT
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def end_headers(self):
+        path = self.path.split('?')[0]
+        if IMMUTABLE.match(path):
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        elif path == '/search-index.js':
+            self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+    def events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        seen = self.reloader.generation
+        try:
+            while True:
+                current = self.reloader.wait(seen)
+                self.wfile.write(b'data: reload\n\n' if current != seen else b': ping\n\n')
+                self.wfile.flush()
+                seen = current
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory, port=8000, reloader=None):
+    ''' Serve `directory` on 127.0.0.1 from a background thread and return the server '''
+    handler = type('Handler', (Handler,), {'reloader': reloader or Reloader()})
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', port), lambda *args: handler(*args, directory=directory))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ------------------------------
+# watching
+
+IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x8, 0x40, 0x80
+IN_CREATE, IN_DELETE = 0x100, 0x200
+IN_CLOEXEC = 0o2000000
+MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct('iIII')
+
+
+def _interesting(name):
+    return not (name.startswith(('.', '#')) or name.endswith(('~', '.swp', '.swx', '.tmp')))
+
+
+def _targets(dirs, files):
+    ''' {directory: None (every file) or {file name: path as given}} '''
+    targets = {d: None for d in dirs if os.path.isdir(d)}
+    for path in files:
+        parent = os.path.dirname(path) or '.'
+        if parent in targets and targets[parent] is None:
+            continue
+        targets.setdefault(parent, {})[os.path.basename(path)] = path
+    return targets
+
+
+def _resolve(targets, parent, name):
+    wanted = targets.get(parent)
+    if wanted is None:
+        return os.path.join(parent, name) if _interesting(name) else None
+    return wanted.get(name)
+
+
+def _inotify(targets):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    watches = {}
+    for parent in targets:
+        wd = libc.inotify_add_watch(fd, os.fsencode(parent), MASK)
+        if wd < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), f'can not watch {parent}')
+        watches[wd] = parent
+    return fd, watches
+
+
+def changes(dirs, files=(), debounce=0.03, interval=0.3):
+    ''' Yield sets of changed paths under `dirs` and among `files`, forever.
+
+    Uses inotify when the platform has it and polls mtimes otherwise. Events
+    that arrive within `debounce` seconds of each other are yielded together,
+    so an editor's save-to-temp-and-rename shows up as one change. '''
+    targets = _targets(dirs, files)
+    try:
+        fd, watches = _inotify(targets)
+    except (OSError, AttributeError, TypeError):
+        yield from _poll(targets, interval)
+        return
+
+    try:
+        while True:
+            changed, timeout = set(), None
+            while select.select([fd], [], [], timeout)[0]:
+                buf = os.read(fd, 65536)
+                offset = 0
+                while offset < len(buf):
+                    wd, mask, cookie, length = EVENT.unpack_from(buf, offset)
+                    offset += EVENT.size
+                    name = buf[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                    offset += length
+                    path = _resolve(targets, watches.get(wd, ''), name) if name else None
+                    if path:
+                        changed.add(path)
+                timeout = debounce
+            if changed:
+                yield changed
+    finally:
+        os.close(fd)
+
+
+def _stamps(targets):
+    stamps = {}
+    for parent, wanted in targets.items():
+        try:
+            names = os.listdir(parent) if wanted is None else list(wanted)
+        except OSError:
+            continue
+        for name in names:
+            path = _resolve(targets, parent, name)
+            if not path:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamps[path] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+
+def _poll(targets, interval):
+    before = _stamps(targets)
+    while True:
+        time.sleep(interval)
+        after = _stamps(targets)
+        changed = {p for p in before.keys() | after.keys() if before.get(p) != after.get(p)}
+        before = after
+        if changed:
+            yield changed
@@ -0,0 +1,330 @@
+''' User-level, content-addressed package store shared by every duck project.
+
+Installed distributions are imported into the store file by file: each file
+is kept once under objects/ by its sha256, and a manifest per distribution
+(dists/<name>/<version>/<tag>.json) lists the files with their digests. A
+project venv is then populated by reflinking (copy-on-write, where the
+filesystem supports it) or hardlinking the objects into site-packages, so a
+package seen by any earlier project is installed without pip, a download or
+an unzip. Anything the store can not satisfy goes to pip as before, and what
+pip installs is imported into the store on the way out.
+
+Objects are made read-only, since a hardlinked file is the same file in the
+store and in every venv that uses it.
+
+    python duckstore.py install <requirement> [...]     (used by duck-hatch) '''
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import sysconfig
+
+import duckdeps
+from duckdeps import InvalidRequirement, InvalidVersion, Requirement, SpecifierSet, Version
+
+STORE = os.environ.get('DUCK_STORE', os.path.join(os.path.expanduser('~'), 'duck', 'store'))
+FICLONE = 0x40049409
+# methods that failed once are not tried again by this process
+_broken = set()
+
+
+def env_tag():
+    ''' Tag of manifests holding compiled code, which only this interpreter and platform can use '''
+    return f'{sys.implementation.cache_tag}-{sysconfig.get_platform()}'.replace('.', '_')
+
+
+def site_packages():
+    return sysconfig.get_paths()['purelib']
+
+
+def digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def place(src, dst):
+    ''' Put `src` at `dst` by reflink, hardlink or copy, whichever works first.
+    Returns the method used. '''
+    tmp = f'{dst}.duck-{os.getpid()}'
+    for method in ('reflink', 'hardlink', 'copy'):
+        if method in _broken:
+            continue
+        try:
+            if method == 'reflink':
+                _reflink(src, tmp)
+                # keep mtimes, or every .pyc of a cloned .py turns stale
+                shutil.copystat(src, tmp)
+            elif method == 'hardlink':
+                os.link(src, tmp)
+            else:
+                shutil.copy2(src, tmp)
+        except (OSError, ImportError):
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            if method == 'copy':
+                raise
+            _broken.add(method)
+            continue
+        os.replace(tmp, dst)
+        return method
+
+
+# ------------------------------
+# reading and writing the store
+
+def object_path(sha, store=STORE):
+    return os.path.join(store, 'objects', sha[:2], sha)
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.duck-{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def wheel_tag(dist):
+    ''' `any` for pure python distributions, env_tag() for everything else '''
+    wheel = dist.read_text('WHEEL') or ''
+    fields = [line.partition(':') for line in wheel.splitlines()]
+    pure = any(k.strip() == 'Root-Is-Purelib' and v.strip().lower() == 'true' for k, _, v in fields)
+    tags = [v.strip() for k, _, v in fields if k.strip() == 'Tag']
+    if pure and tags and all(t.endswith('-none-any') for t in tags):
+        return 'any'
+    return env_tag()
+
+
+def _scripts(dist):
+    ''' {script name: entry point value} for console and gui scripts '''
+    return {ep.name: ep.value for ep in dist.entry_points if ep.group in ('console_scripts', 'gui_scripts')}
+
+
+def ingest(dist, store=STORE):
+    ''' Import an installed distribution into the store and return its
+    manifest path, or None when it can not be shared (editable or url
+    installs, files outside site-packages other than entry point scripts) '''
+    if dist.read_text('direct_url.json') is not None or not dist.files:
+        return None
+    root = os.path.realpath(str(dist.locate_file('')))
+    scripts = _scripts(dist)
+    files = []
+    for entry in dist.files:
+        path = os.path.realpath(str(entry.locate()))
+        rel = os.path.relpath(path, root)
+        if rel.startswith(os.pardir):
+            if os.path.basename(path) in scripts:
+                continue
+            return None
+        if not os.path.isfile(path):
+            continue
+        sha = digest(path)
+        obj = object_path(sha, store)
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            place(path, obj)
+            os.chmod(obj, os.stat(obj).st_mode & 0o555)
+        files.append([rel.replace(os.sep, '/'), sha])
+
+    manifest = {
+        'name': dist.metadata['Name'],
+        'version': dist.version,
+        'requires': dist.requires or [],
+        'requires_python': dist.metadata['Requires-Python'],
+        'scripts': scripts,
+        'files': files,
+    }
+    path = os.path.join(store, 'dists', duckdeps.canonical(manifest['name']), dist.version, f'{wheel_tag(dist)}.json')
+    _write_json(path, manifest)
+    return path
+
+
+def find(req, store=STORE):
+    ''' The manifest of the newest stored version satisfying `req` that this
+    interpreter can use, or None '''
+    here = os.path.join(store, 'dists', duckdeps.canonical(req.name))
+    try:
+        versions = os.listdir(here)
+    except OSError:
+        return None
+    python = '.'.join(map(str, sys.version_info[:3]))
+    candidates = []
+    for version in versions:
+        try:
+            parsed = Version(version)
+        except InvalidVersion:
+            continue
+        if req.specifier.contains(parsed, prereleases=True if req.specifier else False):
+            candidates.append((parsed, version))
+    for _, version in sorted(candidates, reverse=True):
+        for tag in ('any', env_tag()):
+            path = os.path.join(here, version, f'{tag}.json')
+            try:
+                with open(path, 'r') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if manifest.get('requires_python') and python not in SpecifierSet(manifest['requires_python']):
+                continue
+            if all(os.path.exists(object_path(sha, store)) for _, sha in manifest['files']):
+                return manifest
+    return None
+
+
+SCRIPT = '''#!{python}
+# -*- coding: utf-8 -*-
+import re
+import sys
+from {module} import {name}
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit({call}())
+'''
+
+
+def link(manifest, store=STORE):
+    ''' Populate the active environment with a stored distribution. Returns
+    {method: files placed that way}. '''
+    root = site_packages()
+    used = {}
+    for rel, sha in manifest['files']:
+        dst = os.path.join(root, *rel.split('/'))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        method = place(object_path(sha, store), dst)
+        used[method] = used.get(method, 0) + 1
+
+    bin_dir = sysconfig.get_paths()['scripts']
+    for name, value in manifest['scripts'].items():
+        module, _, attr = value.partition(':')
+        attr = attr.split('[')[0].strip()
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(SCRIPT.format(python=sys.executable, module=module.strip(),
+                                  name=attr.split('.')[0], call=attr))
+        os.chmod(path, 0o755)
+
+    # pip reads this when it later upgrades or removes the package
+    info = [rel for rel, _ in manifest['files'] if rel.split('/')[0].endswith('.dist-info')]
+    if info:
+        installer = os.path.join(root, info[0].split('/')[0], 'INSTALLER')
+        if not os.path.exists(installer):
+            with open(installer, 'w') as f:
+                f.write('duck\n')
+    return used
+
+
+# ------------------------------
+# installing
+
+def plan(specs, deps=True, store=STORE):
+    ''' ([manifests to link], [specs left for pip]) for requirement strings.
+    Requirements already installed at a satisfying version are dropped;
+    with `deps`, requirements of linked distributions are followed too. '''
+    have = duckdeps.installed()
+    chosen, rest = {}, []
+    queue = [(spec, {''}) for spec in specs]
+    while queue:
+        spec, extras = queue.pop(0)
+        try:
+            req = Requirement(spec)
+        except InvalidRequirement:
+            rest.append(spec)
+            continue
+        if req.url or not duckdeps.applies(req, extras):
+            if req.url:
+                rest.append(spec)
+            continue
+        key = duckdeps.canonical(req.name)
+        if key in chosen:
+            continue
+        dist = have.get(key)
+        if dist is not None:
+            try:
+                if req.specifier.contains(Version(dist.version), prereleases=True):
+                    continue
+            except InvalidVersion:
+                pass
+            rest.append(spec)
+            continue
+        manifest = find(req, store)
+        if manifest is None:
+            rest.append(spec)
+            continue
+        chosen[key] = manifest
+        if deps:
+            queue += [(line, {''} | set(req.extras)) for line in manifest['requires']]
+    return list(chosen.values()), rest
+
+
+def versions():
+    return {key: dist.version for key, dist in duckdeps.installed().items()}
+
+
+def remember(before, store=STORE):
+    ''' Import every distribution installed or changed since `before`
+    (a versions() result) into the store '''
+    for key, dist in duckdeps.installed().items():
+        if before.get(key) != dist.version and key not in duckdeps.FREEZE_SKIP:
+            try:
+                ingest(dist, store)
+            except OSError:
+                continue
+
+
+def install(specs, deps=True, pip_args=(), store=STORE):
+    ''' Link what the store has, pip install the rest, then import whatever pip
+    installed into the store. Returns ([linked labels], [specs sent to pip],
+    {method: files}, pip exit code). '''
+    manifests, rest = plan(specs, deps, store)
+    used = {}
+    for manifest in manifests:
+        for method, count in link(manifest, store).items():
+            used[method] = used.get(method, 0) + count
+
+    status = 0
+    if rest:
+        before = versions()
+        cmd = [sys.executable, '-m', 'pip', 'install', '--quiet'] + ([] if deps else ['--no-deps'])
+        status = subprocess.run(cmd + list(pip_args) + rest).returncode
+        remember(before, store)
+    return [label(m) for m in manifests], rest, used, status
+
+
+def label(manifest):
+    return f"{manifest['name']}=={manifest['version']}"
+
+
+def stats(store=STORE):
+    ''' (distributions, objects, bytes, objects also linked into some venv) '''
+    dists = objects = size = shared = 0
+    for parent, _, files in os.walk(os.path.join(store, 'dists')):
+        dists += sum(1 for name in files if name.endswith('.json'))
+    for parent, _, files in os.walk(os.path.join(store, 'objects')):
+        for name in files:
+            st = os.stat(os.path.join(parent, name))
+            objects += 1
+            size += st.st_size
+            shared += st.st_nlink > 1
+    return dists, objects, size, shared
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'install':
+        sys.exit(__doc__)
+    linked, rest, used, status = install(sys.argv[2:])
+    if linked:
+        print(f"linked {len(linked)} packages from {STORE}: {', '.join(linked)}")
+    sys.exit(status)
@@ -0,0 +1,498 @@
+''' Parallel test runs for `duck test --jobs N`.
+
+The module is two things at once: the helpers `duck test` uses to start
+worker processes, and a pytest plugin (`pytest -p ducktest`) loaded by each
+worker. Every worker collects the whole suite, computes the same
+longest-processing-time schedule from the durations of earlier runs, and
+keeps only its own share, so there is no separate collection step and no
+node ids on the command line. Workers report outcomes and durations back
+through a JSON file each.
+
+Results are also cached per test file, keyed on the content of the file,
+the conftest.py files above it, every project module it imports
+(transitively, from a static import graph) and the installed packages.
+
+While a test server started by `duck test --serve` is running, the workers
+are forks of it instead of fresh pytest processes (see serve()). '''
+
+import ast
+import hashlib
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+
+CACHE_DIR = 'debug/cache'
+DURATIONS = os.path.join(CACHE_DIR, 'test-durations.json')
+RESULTS = os.path.join(CACHE_DIR, 'test-results.json')
+SOURCES = ['src', 'lib', 'tests']
+
+
+def schedule(nodeids, durations, workers):
+    ''' Longest-processing-time first: every test, slowest first, goes to the
+    worker with the least work so far. Tests without a recorded duration are
+    assumed to take the average. Returns one list of node ids per worker. '''
+    known = [durations[x] for x in nodeids if x in durations]
+    default = sum(known) / len(known) if known else 1.0
+    ordered = sorted(nodeids, key=lambda x: (-durations.get(x, default), x))
+    heap = [(0.0, i) for i in range(workers)]
+    shards = [[] for _ in range(workers)]
+    for nodeid in ordered:
+        load, i = heapq.heappop(heap)
+        shards[i].append(nodeid)
+        heapq.heappush(heap, (load + durations.get(nodeid, default), i))
+    return shards
+
+
+def load_durations(path=DURATIONS):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# ------------------------------
+# pytest plugin side, active only inside workers started by run()
+
+_results = {}
+
+
+def pytest_collection_modifyitems(session, config, items):
+    shard = os.environ.get('DUCK_SHARD')
+    if not shard:
+        return
+    index, workers = (int(x) for x in shard.split('/'))
+    if workers < 2:
+        return
+    mine = set(schedule([item.nodeid for item in items], load_durations(), workers)[index])
+    keep = [item for item in items if item.nodeid in mine]
+    drop = [item for item in items if item.nodeid not in mine]
+    if drop:
+        config.hook.pytest_deselected(items=drop)
+    items[:] = keep
+
+
+def pytest_runtest_logreport(report):
+    if not os.environ.get('DUCK_REPORT'):
+        return
+    entry = _results.setdefault(report.nodeid, {'duration': 0.0, 'outcome': 'passed'})
+    entry['duration'] += report.duration
+    if report.failed:
+        entry['outcome'] = 'error' if report.when != 'call' else 'failed'
+    elif report.skipped and entry['outcome'] == 'passed':
+        entry['outcome'] = 'skipped'
+
+
+def pytest_sessionfinish(session, exitstatus):
+    path = os.environ.get('DUCK_REPORT')
+    if path:
+        with open(path, 'w') as f:
+            json.dump(_results, f)
+
+
+# ------------------------------
+# duck side
+
+def combine(codes):
+    ''' One exit code for all workers: the first real failure wins, and
+    "no tests collected" (5) only counts when every worker had nothing. '''
+    failures = [c for c in codes if c not in (0, 5)]
+    if failures:
+        return failures[0]
+    return 5 if codes and all(c == 5 for c in codes) else 0
+
+
+def _worker_env(i, jobs, cwd):
+    here = os.path.dirname(os.path.abspath(__file__))
+    return dict(os.environ, DUCK_SHARD=f'{i}/{jobs}', DUCK_REPORT=os.path.join(cwd, CACHE_DIR, f'test-report.{i}.json'),
+                PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get('PYTHONPATH')])))
+
+
+def _collect(envs, cwd):
+    ''' Read and remove the workers' reports, and record the durations in them '''
+    results = {}
+    for env in envs:
+        try:
+            with open(env['DUCK_REPORT'], 'r') as f:
+                results.update(json.load(f))
+            os.remove(env['DUCK_REPORT'])
+        except (OSError, ValueError):
+            pass
+    durations = load_durations(os.path.join(cwd, DURATIONS))
+    durations.update({k: v['duration'] for k, v in results.items()})
+    with open(os.path.join(cwd, DURATIONS), 'w') as f:
+        json.dump(durations, f, indent=1, sort_keys=True)
+    return results
+
+
+def run(targets, jobs=1, cwd=None, extra=()):
+    ''' Run pytest over `targets` in `jobs` workers and return
+    (exit code, [(worker output, code)], {nodeid: result}, seconds) '''
+    cwd = cwd or os.getcwd()
+    os.makedirs(os.path.join(cwd, CACHE_DIR), exist_ok=True)
+    color = ['--color=yes'] if sys.stdout.isatty() else []
+    start = time.perf_counter()
+    envs = [_worker_env(i, jobs, cwd) for i in range(jobs)]
+    procs = []
+    for env in envs:
+        # a single worker talks to the terminal directly, several are collected
+        # and printed one after another so their output does not interleave
+        piped = subprocess.PIPE if jobs > 1 else None
+        procs.append(subprocess.Popen(
+            ['pytest', '-p', 'ducktest', *(color if piped else []), *extra, *targets], cwd=cwd, env=env,
+            stdout=piped, stderr=subprocess.STDOUT if piped else None, text=True))
+
+    outputs = []
+    for proc in procs:
+        output = proc.communicate()[0] or ''
+        outputs.append((output, proc.returncode))
+    elapsed = time.perf_counter() - start
+    results = _collect(envs, cwd)
+    return combine([code for _, code in outputs]), outputs, results, elapsed
+
+
+# ------------------------------
+# test server, behind `duck test --serve`
+#
+# A daemon imports pytest, its plugins and, through one collection of the
+# suite, the test modules and everything they import. Every `duck test`
+# then forks it once per worker and runs pytest in the fork. Project
+# modules whose file, or any project file they import, changed since are
+# dropped from sys.modules in the fork first, so they are imported fresh
+# while third-party code stays warm. A change to the installed packages or
+# to duck itself stops the daemon, and the next `duck test` starts another.
+
+SERVE_LOG = 'debug/test-serve.log'
+# the targets the server warmed up on, for restarting it the same way
+SERVE_TARGETS = os.path.join(CACHE_DIR, 'test-serve.json')
+
+
+def socket_path(cwd):
+    import duckwarm
+
+    return duckwarm.socket_path(cwd, 'pytest', [])
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _project_modules(cwd):
+    ''' {module name: file} for loaded modules that are project code, not
+    installed packages (the venv may live inside the project) '''
+    import sysconfig
+
+    outside = tuple(os.path.realpath(p) + os.sep for p in {sys.prefix, sys.base_prefix, *sysconfig.get_paths().values()})
+    found = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        path = os.path.realpath(path)
+        if path.startswith(cwd + os.sep) and not path.startswith(outside):
+            found[name] = path
+    return found
+
+
+def serve(path, targets):
+    ''' The daemon: warm up on `targets`, then run pytest for every request '''
+    import traceback
+    import pytest
+    import duckdeps
+    import duckwarm
+
+    cwd = os.path.realpath(os.getcwd())
+    start = time.perf_counter()
+    pytest.main(['--collect-only', '-q', '-p', 'ducktest', *targets])
+    loaded = _project_modules(cwd)
+    stamps = {file: _stamp(file) for file in loaded.values()}
+    own = {file: _stamp(file) for file in (__file__, duckwarm.__file__)}
+    env = duckdeps.fingerprint()
+    seen = {}
+    print(f'test server: {len(sys.modules)} modules ({len(loaded)} from the project) imported '
+          f'in {time.perf_counter() - start:.2f}s, listening on {path}', flush=True)
+
+    def stale():
+        return duckdeps.fingerprint() != env or any(_stamp(f) != s for f, s in own.items())
+
+    def prepare(request, fds):
+        changed = {file for file, stamp in stamps.items() if _stamp(file) != stamp}
+        evict = []
+        if changed:
+            mods = module_map(cwd)
+            evict = [name for name, file in loaded.items() if changed & set(inputs(file, mods, seen, cwd))]
+
+        def worker(i):
+            def job():
+                for name in evict:
+                    sys.modules.pop(name, None)
+                duckwarm.adopt([fds[0], fds[1 + 2 * i], fds[2 + 2 * i]], request['envs'][i], request['cwd'])
+                try:
+                    code = int(pytest.main(['-p', 'ducktest', *request['args']]))
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                duckwarm.flush()
+                return code
+            return job
+        return [worker(i) for i in range(len(request['envs']))]
+
+    duckwarm.serve_forever(path, prepare, stale)
+
+
+def start_server(targets, cwd):
+    ''' Start the test server for `cwd` in the background. False when one is already running. '''
+    import duckwarm
+
+    path = socket_path(cwd)
+    client = duckwarm.connect(path)
+    if client is not None:
+        client.close()
+        return False
+    os.makedirs(os.path.join(cwd, CACHE_DIR), exist_ok=True)
+    with open(os.path.join(cwd, SERVE_TARGETS), 'w') as f:
+        json.dump(targets, f)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get('PYTHONPATH')])))
+    duckwarm.start(path, [sys.executable, os.path.abspath(__file__), 'serve', path, *targets], cwd, SERVE_LOG,
+                   env=env, timeout=600)
+    return True
+
+
+def stop_server(cwd):
+    import duckwarm
+
+    return duckwarm.stop(socket_path(cwd))
+
+
+def served(targets, jobs=1, cwd=None, extra=()):
+    ''' run() through the test server for `cwd`, restarting it when it was
+    stale. None when no server is running. '''
+    import tempfile
+    import duckwarm
+
+    cwd = cwd or os.getcwd()
+    try:
+        path = socket_path(cwd)
+    except OSError as exc:
+        print(f'test server not used: {exc}', file=sys.stderr)
+        return None
+    if not os.path.exists(path):
+        return None
+    os.makedirs(os.path.join(cwd, CACHE_DIR), exist_ok=True)
+    color = ['--color=yes'] if sys.stdout.isatty() and jobs > 1 else []
+    envs = [_worker_env(i, jobs, cwd) for i in range(jobs)]
+    request = {'args': [*color, *extra, *targets], 'envs': envs, 'cwd': cwd}
+    # one worker writes to the terminal, several to a file each, like run()
+    files = [tempfile.TemporaryFile() for _ in range(jobs)] if jobs > 1 else []
+    fds = [0] + ([fd for f in files for fd in (f.fileno(), f.fileno())] if files else [1, 2])
+
+    start = time.perf_counter()
+    codes = duckwarm.call(path, request, fds)
+    if codes is None:
+        try:
+            with open(os.path.join(cwd, SERVE_TARGETS)) as f:
+                warm = json.load(f)
+        except (OSError, ValueError):
+            warm = ['tests/']
+        if start_server(warm, cwd):
+            start = time.perf_counter()
+            codes = duckwarm.call(path, request, fds)
+        if codes is None:
+            return None
+    elapsed = time.perf_counter() - start
+
+    outputs = []
+    for i, code in enumerate(codes):
+        output = ''
+        if files:
+            files[i].seek(0)
+            output = files[i].read().decode(errors='replace')
+            files[i].close()
+        outputs.append((output, code))
+    results = _collect(envs, cwd)
+    return combine(codes), outputs, results, elapsed
+
+
+# ------------------------------
+# result cache
+
+def _python_files(root):
+    for parent, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d not in ('debug', '__pycache__'))
+        for name in sorted(files):
+            if name.endswith('.py'):
+                yield os.path.join(parent, name)
+
+
+def module_map(cwd):
+    ''' {dotted module name: file} for project code. Every file is known both
+    from the project root (`src.pkg.mod`) and from its source directory
+    (`pkg.mod`), since tests import it either way. '''
+    mods = {}
+    for root in SOURCES:
+        for path in _python_files(os.path.join(cwd, root)):
+            rel = os.path.splitext(os.path.relpath(path, cwd))[0].split(os.sep)
+            if rel[-1] == '__init__':
+                rel = rel[:-1]
+            for name in ('.'.join(rel), '.'.join(rel[1:])):
+                if name:
+                    mods.setdefault(name, path)
+    return mods
+
+
+def imports_of(path, seen, cwd):
+    ''' Dotted names a file may import, relative imports resolved. `seen` is
+    the {path: [mtime, size, names]} memo kept in the results cache. '''
+    stat = os.stat(path)
+    stamp = [stat.st_mtime_ns, stat.st_size]
+    if path in seen and seen[path][:2] == stamp:
+        return seen[path][2]
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read())
+    except (SyntaxError, ValueError):
+        tree = ast.Module(body=[], type_ignores=[])
+
+    package = [x for x in os.path.relpath(os.path.dirname(path), cwd).split(os.sep) if x != '.']
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module.split('.') if node.module else []
+            if node.level:
+                base = package[:len(package) - node.level + 1] + base
+            prefix = '.'.join(base)
+            names.add(prefix)
+            names.update(f'{prefix}.{alias.name}' if prefix else alias.name for alias in node.names)
+    seen[path] = stamp + [sorted(names)]
+    return seen[path][2]
+
+
+def _resolve(name, mods):
+    ''' Files run by importing `name`: the module and every package above it '''
+    found = []
+    parts = name.split('.')
+    for i in range(1, len(parts) + 1):
+        path = mods.get('.'.join(parts[:i]))
+        if path:
+            found.append(path)
+    return found
+
+
+def inputs(test_file, mods, seen, cwd):
+    ''' The test file, its conftest.py files and every project module it
+    reaches through imports, sorted '''
+    files, stack = {test_file}, [test_file]
+    parent = os.path.dirname(test_file)
+    while parent.startswith(cwd):
+        conftest = os.path.join(parent, 'conftest.py')
+        if os.path.isfile(conftest) and conftest not in files:
+            files.add(conftest)
+            stack.append(conftest)
+        if parent == cwd:
+            break
+        parent = os.path.dirname(parent)
+    while stack:
+        for name in imports_of(stack.pop(), seen, cwd):
+            for path in _resolve(name, mods):
+                if path not in files:
+                    files.add(path)
+                    stack.append(path)
+    return sorted(files)
+
+
+def test_files(targets, cwd):
+    ''' Test files named by pytest targets; node ids (`file::test`) are not cacheable '''
+    found = []
+    for target in targets:
+        path = os.path.join(cwd, target)
+        if '::' in target:
+            return None
+        if os.path.isdir(path):
+            found += [p for p in _python_files(path)
+                      if os.path.basename(p).startswith('test_') or p.endswith('_test.py')]
+        elif os.path.isfile(path):
+            found.append(os.path.normpath(path))
+    return found
+
+
+def keys(files, cwd, seen):
+    ''' {test file relative to cwd: cache key} '''
+    import duckdeps
+
+    mods = module_map(cwd)
+    env = duckdeps.fingerprint()
+    found = {}
+    for test_file in files:
+        digest = hashlib.sha256(env.encode())
+        for path in inputs(os.path.abspath(test_file), mods, seen, cwd):
+            with open(path, 'rb') as f:
+                digest.update(os.path.relpath(path, cwd).encode() + b'\0' + hashlib.sha256(f.read()).digest())
+        found[os.path.relpath(test_file, cwd)] = digest.hexdigest()
+    return found
+
+
+def split(targets, cwd, cache=True):
+    ''' (targets still to run, {file: cached results}, state to pass to remember()).
+    Returns the targets unchanged when nothing can be cached. '''
+    cwd = os.path.abspath(cwd)
+    files = test_files(targets, cwd) if cache else None
+    if not files:
+        return targets, {}, None
+    try:
+        with open(os.path.join(cwd, RESULTS), 'r') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    seen = stored.get('imports', {})
+    current = keys(files, cwd, seen)
+    hits = {}
+    for rel, key in current.items():
+        entry = stored.get('files', {}).get(rel)
+        if entry and entry['key'] == key:
+            hits[rel] = entry['results']
+    pending = [rel for rel in current if rel not in hits]
+    return pending, hits, {'keys': current, 'stored': stored, 'imports': seen}
+
+
+def tally(results):
+    ''' `2 passed, 1 skipped` for {nodeid: result}, in pytest's own order '''
+    counts = {}
+    for result in results.values():
+        counts[result['outcome']] = counts.get(result['outcome'], 0) + 1
+    order = ['failed', 'passed', 'skipped', 'error']
+    found = sorted(counts, key=lambda x: (order.index(x) if x in order else len(order), x))
+    return ', '.join(f'{counts[outcome]} {outcome}' for outcome in found)
+
+
+def remember(state, results, cwd):
+    ''' Store results of files whose tests all passed or were skipped '''
+    if state is None:
+        return
+    by_file = {}
+    for nodeid, result in results.items():
+        by_file.setdefault(os.path.normpath(nodeid.split('::')[0]), {})[nodeid] = result
+    files = state['stored'].get('files', {})
+    for rel, key in state['keys'].items():
+        found = by_file.get(rel)
+        if found and all(r['outcome'] in ('passed', 'skipped') for r in found.values()):
+            files[rel] = {'key': key, 'results': found}
+        elif found:
+            files.pop(rel, None)
+    with open(os.path.join(cwd, RESULTS), 'w') as f:
+        json.dump({'files': files, 'imports': state['imports']}, f)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'serve':
+        sys.exit('python ducktest.py serve <socket> <target> [...]')
+    serve(sys.argv[2], sys.argv[3:])
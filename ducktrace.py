@@ -0,0 +1,263 @@
+''' Timing instrumentation behind `duck --trace`.
+
+start() patches what a command spends its time on, for this process only:
+subprocess.Popen (a span from spawn to exit), open() (from open to close,
+with the bytes moved), toml.load/loads/dump/dumps and first imports. The
+command itself is one span around everything, and its phases are marked
+with `with ducktrace.span(...)` where they happen (see duckcli, duckdeps,
+ducker).
+
+finish() writes the spans as a Chrome trace-event file (chrome://tracing,
+ui.perfetto.dev) under debug/trace/ and returns a plain-text summary. Spans
+nest, so the summary adds up self time: a span's duration less the spans
+nested in it on the same thread. '''
+
+import builtins
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_DIR = 'debug/trace'
+TOP = 15
+
+_events = []
+_open = []
+_threads = {}
+_origin = None
+_real = {}
+
+
+def _now():
+    return (time.perf_counter() - _origin) * 1e6
+
+
+def _tid():
+    ident = threading.get_ident()
+    if ident not in _threads:
+        _threads[ident] = len(_threads) + 1
+    return _threads[ident]
+
+
+def _record(name, cat, begin, args=None):
+    event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': round(begin, 1),
+             'dur': round(_now() - begin, 1), 'pid': os.getpid(), 'tid': _tid()}
+    if args:
+        event['args'] = args
+    _events.append(event)
+
+
+class span:
+    ''' Context manager timing one phase. Its `seconds` are set either way,
+    it is only recorded while tracing. '''
+
+    def __init__(self, name, cat='phase', **args):
+        self.name, self.cat, self.args = name, cat, args
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.begin = _now() if _origin is not None else None
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        if self.begin is not None and _origin is not None:
+            _record(self.name, self.cat, self.begin, self.args)
+
+
+# ------------------------------
+# instrumented stand-ins
+
+class _File:
+    ''' What open() returns while tracing: the real file, plus a span that
+    ends when it is closed '''
+
+    def __init__(self, f, name, mode):
+        self._f, self._name, self._mode = f, name, mode
+        self._begin, self._bytes = _now(), 0
+        _open.append(self)
+
+    def read(self, *args):
+        data = self._f.read(*args)
+        self._bytes += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._f.readline(*args)
+        self._bytes += len(data)
+        return data
+
+    def write(self, data):
+        self._bytes += len(data)
+        return self._f.write(data)
+
+    def category(self):
+        return 'file write' if any(x in self._mode for x in 'wax+') else 'file read'
+
+    def close(self):
+        if self in _open:
+            _open.remove(self)
+            _record(self._name, self.category(), self._begin, {'mode': self._mode, 'bytes': self._bytes})
+        self._f.close()
+
+    def __iter__(self):
+        for line in self._f:
+            self._bytes += len(line)
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def _traced_open(file, mode='r', *args, **kwargs):
+    f = _real['open'](file, mode, *args, **kwargs)
+    if isinstance(file, int):
+        return f
+    return _File(f, os.fspath(file), mode)
+
+
+def _traced_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _real['import'](name, globals, locals, fromlist, level)
+    begin = _now()
+    try:
+        return _real['import'](name, globals, locals, fromlist, level)
+    finally:
+        _record(f'import {name}', 'import', begin)
+
+
+def _wrap(module, attr, cat):
+    real = getattr(module, attr)
+
+    def traced(*args, **kwargs):
+        label = args[0] if attr == 'load' and args and isinstance(args[0], str) else ''
+        begin = _now()
+        try:
+            return real(*args, **kwargs)
+        finally:
+            _record(f'{module.__name__}.{attr} {label}'.rstrip(), cat, begin)
+    setattr(module, attr, traced)
+
+
+def _popen():
+    import subprocess
+
+    class Popen(subprocess.Popen):
+        def __init__(self, args, *rest, **kwargs):
+            self._trace_begin = _now()
+            argv = [args] if isinstance(args, (str, bytes, os.PathLike)) else list(args)
+            self._trace_name = ' '.join(os.path.basename(str(x)) if i == 0 else str(x)
+                                        for i, x in enumerate(argv[:4]))
+            self._trace_args = {'argv': [str(x) for x in argv], 'cwd': str(kwargs.get('cwd') or '.')}
+            self._trace_tid = _tid()
+            super().__init__(args, *rest, **kwargs)
+            _open.append(self)
+
+        def _trace_done(self):
+            if self.returncode is not None and self in _open:
+                _open.remove(self)
+                self._trace_args['exit'] = self.returncode
+                _events.append({'name': self._trace_name, 'cat': 'subprocess', 'ph': 'X',
+                                'ts': round(self._trace_begin, 1), 'dur': round(_now() - self._trace_begin, 1),
+                                'pid': os.getpid(), 'tid': self._trace_tid, 'args': self._trace_args})
+
+        def wait(self, timeout=None):
+            try:
+                return super().wait(timeout)
+            finally:
+                self._trace_done()
+
+        def poll(self):
+            code = super().poll()
+            self._trace_done()
+            return code
+
+    subprocess.Popen = Popen
+
+
+# ------------------------------
+# duck side
+
+def start():
+    ''' Begin tracing this process '''
+    global _origin
+    import toml
+
+    if _origin is not None:
+        return
+    _origin = time.perf_counter()
+    _real['open'], _real['import'] = builtins.open, builtins.__import__
+    builtins.open, builtins.__import__ = _traced_open, _traced_import
+    _popen()
+    for attr in ('load', 'loads', 'dump', 'dumps'):
+        _wrap(toml, attr, 'toml')
+
+
+def self_times(events):
+    ''' [self time] per event: its duration less the time covered by spans
+    nested in it on the same thread. Overlapping spans that do not nest
+    (processes running side by side) count as nested up to the outer end. '''
+    own = [event['dur'] for event in events]
+    threads = {}
+    for i, event in enumerate(events):
+        threads.setdefault(event['tid'], []).append(i)
+    for indexes in threads.values():
+        stack = []
+        for i in sorted(indexes, key=lambda i: (events[i]['ts'], -events[i]['dur'])):
+            event = events[i]
+            while stack and events[stack[-1]]['ts'] + events[stack[-1]]['dur'] <= event['ts']:
+                stack.pop()
+            if stack:
+                parent = events[stack[-1]]
+                own[stack[-1]] -= min(event['ts'] + event['dur'], parent['ts'] + parent['dur']) - event['ts']
+            stack.append(i)
+    return own
+
+
+def _summary(events, total, path):
+    totals = {}
+    for event, own in zip(events, self_times(events)):
+        count, dur = totals.get(event['cat'], (0, 0.0))
+        totals[event['cat']] = (count + 1, dur + max(own, 0))
+    lines = [f'trace: {path} (open in chrome://tracing or ui.perfetto.dev)',
+             f'total {total / 1000:.1f}ms, {len(events)} spans',
+             f"{'category':<12} {'spans':>6} {'self time':>11}"]
+    for cat, (count, dur) in sorted(totals.items(), key=lambda x: -x[1][1]):
+        lines.append(f'{cat:<12} {count:>6} {dur / 1000:>9.1f}ms')
+    lines.append(f'slowest {min(TOP, len(events))} spans')
+    for event in sorted(events, key=lambda x: -x['dur'])[:TOP]:
+        lines.append(f"{event['dur'] / 1000:>9.1f}ms  {event['cat']:<11} {event['name']}")
+    return '\n'.join(lines)
+
+
+def finish(name='duck'):
+    ''' Stop tracing, write the trace file and return (path, summary).
+    Spans still open (files never closed, processes never waited for) end here. '''
+    global _origin
+    if _origin is None:
+        return None, ''
+    builtins.open, builtins.__import__ = _real['open'], _real['import']
+    for item in list(_open):
+        if isinstance(item, _File):
+            _record(item._name, item.category(), item._begin, {'mode': item._mode, 'bytes': item._bytes, 'unclosed': True})
+        else:
+            _record(item._trace_name, 'subprocess', item._trace_begin, dict(item._trace_args, running=True))
+    del _open[:]
+    total = _now()
+    events = sorted(_events, key=lambda x: x['ts'])
+    _origin = None
+
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    stem = ''.join(c if c.isalnum() or c in '-_' else '-' for c in name).strip('-') or 'duck'
+    path = os.path.join(TRACE_DIR, f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return path, _summary(events, total, path)
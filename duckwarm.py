@@ -0,0 +1,381 @@
+''' Warm interpreter for `duck run --warm`.
+
+A daemon per project imports the modules listed under [main] warm in
+duck.toml once, then listens on a Unix socket. Every run request forks the
+daemon: the child takes over the client's stdin, stdout and stderr (passed
+over the socket as file descriptors), its argv, environment and working
+directory, and runs the main file as __main__ with those modules already
+in sys.modules. The client gets the child's pid (to forward Ctrl-C) and
+finally its exit code.
+
+The daemon exits after IDLE seconds without requests, and as soon as a
+file of any module it imported changed, so a run never sees stale code;
+the client then starts a fresh one.
+
+A request carries the client's environment and its terminal, and the
+daemon runs whatever it is sent, so both ends only talk to their own user:
+the socket lives in a directory only the user can enter (socket_dir), and
+where the platform tells (SO_PEERCRED), each side checks who the other is.
+
+    python duckwarm.py serve <socket> <main file> <module> [...] '''
+
+import hashlib
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import time
+
+IDLE = 1800
+LOG = 'debug/warm.log'
+
+
+def socket_dir():
+    ''' duck-<uid> under $XDG_RUNTIME_DIR or the temp dir, created 0700. Raises
+    OSError when it exists but is not a directory private to this user, as
+    someone else could then listen in the daemon's place. '''
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    path = os.path.join(base, f'duck-{os.getuid()}')
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise OSError(f'{path} must be a directory only you can access (chmod 700), not using it')
+    return path
+
+
+def socket_path(cwd, file, modules):
+    ''' One daemon per project, main file, interpreter and module list. Unix
+    socket paths are short (around 100 bytes), so it is named by a digest. '''
+    key = json.dumps([os.path.abspath(cwd), file, sys.executable, sorted(modules)])
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(socket_dir(), f'{digest}.sock')
+
+
+def same_user(sock):
+    ''' Whether the process on the other end of `sock` runs as this user.
+    True where the platform cannot tell, socket_dir() guards those. '''
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1] == os.getuid()
+
+
+# ------------------------------
+# daemon side
+
+def _stamps():
+    ''' {file: mtime} for every module imported so far '''
+    stamps = {}
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path:
+            try:
+                stamps[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+    return stamps
+
+
+def _stale(stamps):
+    for path, mtime in stamps.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def adopt(fds, env, cwd):
+    ''' In a forked child: take `fds` as stdin, stdout and stderr, and the
+    client's environment and working directory '''
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+    for fd in set(fds):
+        if fd > 2:
+            os.close(fd)
+    sys.stdin = open(0, 'r', closefd=False)
+    sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, 'w', buffering=1, closefd=False)
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+
+
+def flush():
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except (OSError, ValueError):
+            pass
+
+
+def _child(request, fds):
+    ''' Runs in the forked child: become the client's process and run the script '''
+    import runpy
+    import traceback
+
+    adopt(fds, request['env'], request['cwd'])
+    script = request['file']
+    sys.argv = [script] + request['args']
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+
+    code = 0
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as exc:
+        if exc.code is None:
+            code = 0
+        elif isinstance(exc.code, int):
+            code = exc.code
+        else:
+            print(exc.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    flush()
+    return code
+
+
+def serve_forever(path, prepare, stale, idle=IDLE):
+    ''' Answer requests on the Unix socket `path`. prepare(request, fds)
+    returns one callable per child to fork; each runs in its own child and
+    returns its exit code. The client gets {"pids": [...]} and, once all
+    of them finished, {"exit": [...]}. Stops after `idle` seconds without
+    work, on a {"stop": true} request, or when stale() is true as a request
+    comes in (the client is told {"stale": true}). '''
+    import select
+
+    # bound under another name and renamed once listening, so a client that
+    # sees `path` can always connect
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(f'{path}.{os.getpid()}')
+    server.listen(16)
+    os.replace(f'{path}.{os.getpid()}', path)
+    inode = os.stat(path).st_ino
+
+    def release():
+        # a daemon started after this one may own the path by now
+        try:
+            if os.stat(path).st_ino == inode:
+                os.remove(path)
+        except OSError:
+            pass
+
+    def refuse(conn, fds, exc):
+        # a malformed request only costs its own connection
+        try:
+            conn.sendall(json.dumps({'error': f'bad request: {exc!r}'}).encode() + b'\n')
+        except OSError:
+            pass
+        conn.close()
+        for fd in set(fds):
+            os.close(fd)
+
+    # children are reaped from the main loop only, woken up by SIGCHLD, so
+    # the daemon never has a second thread around when it forks
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    running = {}
+    try:
+        while True:
+            ready = select.select([server, wake_r], [], [], None if running else idle)[0]
+            if not ready:
+                break
+            if wake_r in ready:
+                os.read(wake_r, 4096)
+                for conn, (pids, codes) in list(running.items()):
+                    for i, pid in enumerate(pids):
+                        if codes[i] is not None:
+                            continue
+                        done, status = os.waitpid(pid, os.WNOHANG)
+                        if done:
+                            code = os.waitstatus_to_exitcode(status)
+                            codes[i] = 128 - code if code < 0 else code
+                    if None not in codes:
+                        try:
+                            conn.sendall(json.dumps({'exit': codes}).encode() + b'\n')
+                        except OSError:
+                            pass
+                        conn.close()
+                        del running[conn]
+            if server not in ready:
+                continue
+
+            conn, _ = server.accept()
+            if not same_user(conn):
+                conn.close()
+                continue
+            data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 255)
+            while data and not data.endswith(b'\n'):
+                more = conn.recv(1 << 16)
+                if not more:
+                    break
+                data += more
+            try:
+                request = json.loads(data or b'{}')
+                if not isinstance(request, dict):
+                    raise ValueError('not an object')
+            except ValueError as exc:
+                refuse(conn, fds, exc)
+                continue
+            if request.get('stop') or stale():
+                release()
+                conn.sendall(b'{}\n' if request.get('stop') else b'{"stale": true}\n')
+                conn.close()
+                for fd in fds:
+                    os.close(fd)
+                break
+            try:
+                jobs = prepare(request, fds)
+            except (KeyError, IndexError, TypeError, ValueError) as exc:
+                refuse(conn, fds, exc)
+                continue
+            pids = []
+            for job in jobs:
+                pid = os.fork()
+                if pid == 0:
+                    code = 1
+                    try:
+                        server.close()
+                        conn.close()
+                        os.close(wake_r)
+                        os.close(wake_w)
+                        signal.set_wakeup_fd(-1)
+                        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                        code = job()
+                    finally:
+                        # never fall back into the daemon's loop
+                        os._exit(code & 0xff)
+                pids.append(pid)
+            for fd in set(fds):
+                os.close(fd)
+            running[conn] = (pids, [None] * len(pids))
+            conn.sendall(json.dumps({'pids': pids}).encode() + b'\n')
+    finally:
+        server.close()
+        release()
+
+
+def serve(path, file, modules):
+    import importlib
+
+    # the same sys.path as `python <file>`, so project modules import too
+    sys.path[0] = os.path.dirname(os.path.abspath(file))
+    for name in modules:
+        importlib.import_module(name)
+    stamps = _stamps()
+    print(f'warm: {len(modules)} modules, {len(stamps)} files imported, listening on {path}', flush=True)
+    serve_forever(path, lambda request, fds: [lambda: _child(request, fds)], lambda: _stale(stamps))
+
+
+# ------------------------------
+# client side
+
+def start(path, command, cwd, log, env=None, timeout=60):
+    ''' Start a daemon (`command`) in the background and wait until it listens on `path` '''
+    import subprocess
+
+    log = os.path.join(cwd, log)
+    os.makedirs(os.path.dirname(log), exist_ok=True)
+    # left behind by a daemon that was killed
+    if os.path.exists(path) and not stop(path):
+        os.remove(path)
+    with open(log, 'a') as out:
+        proc = subprocess.Popen(command, cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=out,
+                                stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            raise OSError(f'the daemon did not start, see {log}')
+        time.sleep(0.01)
+
+
+def connect(path):
+    ''' A socket connected to the daemon on `path`, None when none listens.
+    Raises OSError when another user is listening there. '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    if not same_user(client):
+        client.close()
+        raise OSError(f'{path} is served by another user, not sending anything there')
+    return client
+
+
+def stop(path):
+    ''' Ask the daemon listening on `path` to exit. Returns False when none was running. '''
+    client = connect(path)
+    if client is None:
+        return False
+    with client:
+        client.sendall(b'{"stop": true}\n')
+        client.recv(64)
+    return True
+
+
+def call(path, request, fds):
+    ''' Send `request` and `fds` to the daemon on `path`, forwarding Ctrl-C
+    to its children, and return their exit codes. None when no daemon took
+    the request (none listening, or it was stale and is exiting). '''
+    client = connect(path)
+    if client is None:
+        return None
+    with client:
+        socket.send_fds(client, [json.dumps(request).encode() + b'\n'], fds)
+        reader = client.makefile('rb')
+        pids = []
+        while True:
+            try:
+                line = reader.readline()
+            except KeyboardInterrupt:
+                for pid in pids:
+                    try:
+                        os.kill(pid, signal.SIGINT)
+                    except OSError:
+                        pass
+                continue
+            except ConnectionError:
+                line = b''
+            if not line:
+                return None if not pids else [1] * len(pids)
+            reply = json.loads(line)
+            if reply.get('stale'):
+                return None
+            if 'error' in reply:
+                raise OSError(f"the daemon refused the request ({reply['error']})")
+            pids = reply.get('pids', pids)
+            if 'exit' in reply:
+                return reply['exit']
+
+
+def run(file, args, cwd, modules):
+    ''' Run `file` in a fork of the warm daemon and return its exit code.
+    Starts the daemon when none is listening, or when it was stale. '''
+    path = socket_path(cwd, file, modules)
+    request = {'file': file, 'args': list(args), 'cwd': cwd, 'env': dict(os.environ)}
+    for _ in range(3):
+        codes = call(path, request, [0, 1, 2])
+        if codes is not None:
+            return codes[0]
+        start(path, [sys.executable, os.path.abspath(__file__), 'serve', path, file, *modules], cwd, LOG)
+    raise OSError('the warm interpreter keeps restarting')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] != 'serve':
+        sys.exit(__doc__)
+    serve(sys.argv[2], sys.argv[3], sys.argv[4:])
@@ -12,7 +12,18 @@ path=$HOME/Documents/duck
 mkdir -p $HOME/duck/
 mkdir -p $HOME/duck/src/
 cp -rf $path/main.py $HOME/duck/src/main.py
+cp -rf $path/duckcli.py $HOME/duck/src/duckcli.py
 cp -rf $path/ducker.py $HOME/duck/src/ducker.py
+cp -rf $path/duckdeps.py $HOME/duck/src/duckdeps.py
+cp -rf $path/duckserve.py $HOME/duck/src/duckserve.py
+cp -rf $path/ducktest.py $HOME/duck/src/ducktest.py
+cp -rf $path/duckprof.py $HOME/duck/src/duckprof.py
+cp -rf $path/duckbench.py $HOME/duck/src/duckbench.py
+cp -rf $path/duckstore.py $HOME/duck/src/duckstore.py
+cp -rf $path/duckenv.py $HOME/duck/src/duckenv.py
+cp -rf $path/duckindex.py $HOME/duck/src/duckindex.py
+cp -rf $path/duckwarm.py $HOME/duck/src/duckwarm.py
+cp -rf $path/ducktrace.py $HOME/duck/src/ducktrace.py
 cp -rf $path/fonts $HOME/duck/
 cp -rf $path/images $HOME/duck/
 
@@ -21,12 +32,11 @@ duck_hatch() {
     mkdir -p debug 
     python3 -m venv debug/ducky/ 
     source debug/ducky/bin/activate 
-    pip install --quiet pytest click colorama toml 
+    # links packages any earlier project already installed, pip gets the rest
+    python $HOME/duck/src/duckstore.py install pytest click colorama toml 
 
+    # duck doc writes the font and images itself, under content-hashed names
     mkdir -p debug/html 
-    cp -rf $HOME/duck/images/logo.svg debug/html/ 
-    cp -rf $HOME/duck/images/duck.jpg debug/html/ 
-    cp -rf $HOME/duck/fonts debug/html/ 
 }
 
 alias duck-duck='source debug/ducky/bin/activate'